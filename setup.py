@@ -87,7 +87,7 @@ setup( name = 'univention-umc',
 	   version = '1.0',
 	   package_dir = { '' : '.' },
 	   packages = [ 'univention', 'univention.umc', 'univention.umc.authentication', 'univention.umc.module', 'univention.umc.resources', 'univention.umc.server', 'univention.umc.util'],
-	   scripts = [ 'scripts/umc-server', 'scripts/umc-module' ],
+	   scripts = [ 'scripts/umc-server', 'scripts/umc-module', 'scripts/umc-module-zygote' ],
 	   data_files = [],
 	   cmdclass = { 'build' : Build,
 	   				'build_i18n' : BuildI18N }
@@ -40,30 +40,42 @@ from univention.umc.interfaces import (
 	implements, Translation, User, ACLs, ModuleProcess,
 	NotAuthenticated, AuthenticationFailed,
 	PasswordExpired, PasswordChangeFailed,
-	CouldNotConnect
+	CouldNotConnect, TooManyProcesses
 )
 
 def main():
 	import sys
 	import os.path
-	from univention.umc.server import ServerDaemon
-	from univention.umc.module import ModuleDaemon
+
+	def server():
+		from univention.umc.server import ServerDaemon
+		return ServerDaemon
+
+	def module():
+		from univention.umc.module import ModuleDaemon
+		return ModuleDaemon
+
+	def zygote():
+		# must not import the twisted reactor, so it is imported separately
+		from univention.umc.zygote import ModuleZygote
+		return ModuleZygote
 
 	name = os.path.basename(sys.argv[0])
 	try:
 		Daemon = {
-			'umc-server': ServerDaemon,
-			'univention-management-console-server': ServerDaemon,
-			'umc-module': ModuleDaemon,
-			'univention-management-console-module': ModuleDaemon,
-		}[name]
+			'umc-server': server,
+			'univention-management-console-server': server,
+			'umc-module': module,
+			'univention-management-console-module': module,
+			'umc-module-zygote': zygote,
+			'univention-management-console-module-zygote': zygote,
+		}[name]()
 	except KeyError:
 		import sys
-		raise SystemExit('use umc-server or umc-module! not %s' % sys.argv[0])
+		raise SystemExit('use umc-server, umc-module or umc-module-zygote! not %s' % sys.argv[0])
 	else:
 		Daemon()
 
-
 if __name__ == '__main__':
 	try:
 		main()
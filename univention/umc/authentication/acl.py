@@ -30,6 +30,7 @@
 # <http://www.gnu.org/licenses/>.
 
 import json
+from hashlib import sha1
 
 from univention.management.console.acl import ACLs, LDAP_ACLs
 
@@ -53,6 +54,14 @@ class LdapACLs(object):  # FIXME: parameter aren't nice for an interface
 		lo, po = get_machine_connection()
 		self.acls = LDAP_ACLs(lo, user.username, ucr['ldap/base'])
 		self.__permitted_commands = None
+		self.__json = None
+		self.__version = None
+
+	@property
+	def version(self):
+		if self.__version is None:
+			self.__version = sha1(self.json()).hexdigest()
+		return self.__version
 
 	def is_command_allowed(self, request, command):
 		kwargs = {}
@@ -66,10 +75,11 @@ class LdapACLs(object):  # FIXME: parameter aren't nice for an interface
 		return self.acls.is_command_allowed(command, **kwargs)
 
 	def get_permitted_commands(self, moduleManager):
-		if self.__permitted_commands is None:
+		# the module definitions are replaced, never modified, on reload
+		if self.__permitted_commands is None or self.__permitted_commands[0] is not moduleManager:
 			# fixes performance leak?
-			self.__permitted_commands = moduleManager.permitted_commands(ucr['hostname'], self.acls)
-		return self.__permitted_commands
+			self.__permitted_commands = (moduleManager, moduleManager.permitted_commands(ucr['hostname'], self.acls))
+		return self.__permitted_commands[1]
 
 	def get_module_providing(self, moduleManager, command):
 		permitted_commands = self.get_permitted_commands(moduleManager)
@@ -82,4 +92,6 @@ class LdapACLs(object):  # FIXME: parameter aren't nice for an interface
 			return method
 
 	def json(self):
-		return json.dumps(self.acls.json())
+		if self.__json is None:
+			self.__json = json.dumps(self.acls.json(), sort_keys=True)
+		return self.__json
@@ -74,5 +74,21 @@ class PAMAuthenticatedUser(object):
 		self.password = password
 		self._init_user()
 
+	def get_state(self):
+		return dict(
+			authenticated=self.__authenticated,
+			username=self.username,
+			password=self.password,
+			userdn=self.userdn,
+			ip=self.ip,
+		)
+
+	def set_state(self, state):
+		self.__authenticated = state['authenticated']
+		self.username = state['username']
+		self.password = state['password']
+		self.userdn = state['userdn']
+		self.ip = state['ip']
+
 	def _init_user(self):
 		self.userdn = get_userdn_by_username(self.username)
@@ -55,6 +55,10 @@ class CouldNotConnect(Exception):
 	pass
 
 
+class TooManyProcesses(Exception):
+	pass
+
+
 class Translation(Interface):
 
 	def set_language(locale):
@@ -84,9 +88,17 @@ class User(Interface):
 	def change_expired_password(username, old_password, new_password):
 		pass
 
+	def get_state():
+		"""The authentication state which is needed to restore the user in another process"""
+
+	def set_state(state):
+		pass
+
 
 class ACLs(Interface):
 
+	version = Attribute("A fingerprint of the ACLs which changes when they change")
+
 	def is_command_allowed(command, hostname=None, options={}, flavor=None):
 		return False
 
@@ -109,6 +121,10 @@ class ModuleProcess(Interface):
 	socket = Attribute("The UNIX socket filename of the process")
 	pid = Attribute("The process id")
 	user = Attribute("The owner of the process")
+	sessions = Attribute("The UIDs of the sessions which use the process")
+	pending = Attribute("The number of requests which are currently processed")
+	last_request = Attribute("The time of the last request")
+	acls = Attribute("The filename of the ACLs passed to the process")
 
 	def connect():
 		pass
@@ -116,5 +132,11 @@ class ModuleProcess(Interface):
 	def request(request):
 		pass
 
+	def set_acls(acls):
+		pass
+
+	def cleanup():
+		pass
+
 	def kill(signal):
 		pass
@@ -32,7 +32,8 @@
 from __future__ import absolute_import
 
 import sys
-from os import getuid, umask
+import json
+from os import getuid, getpid, umask, write, close
 from os.path import basename
 from argparse import ArgumentParser
 
@@ -41,8 +42,9 @@ import notifier.log as nflog
 
 from twisted.internet import reactor
 
-from univention.umc.util import ucr, set_locale
+from univention.umc.util import ucr, set_locale, MODULE
 from univention.umc.server import Daemon
+from univention.umc.zygote import PRELOAD_MODULES, preload
 
 from univention.umc.module.site import ModuleServer
 
@@ -55,9 +57,25 @@ class ModuleDaemon(Daemon):
 	@property
 	def logfile(self):
 		if not self.options.logfile.startswith('/dev'):
-			return '%s-%s' % (self.options.logfile, self.options.module)
+			return '%s-%s' % (self.options.logfile, self.module_name)
 		return self.options.logfile
 
+	@property
+	def modules(self):
+		return self.options.module.split(',')
+
+	@property
+	def module_name(self):
+		if not self.options.module:
+			return 'prefork'
+		if len(self.modules) > 1:
+			return 'host'
+		return self.options.module
+
+	@property
+	def preload_modules(self):
+		return ucr.get('umc/module/prefork/preload', ' '.join(PRELOAD_MODULES)).split()
+
 	@property
 	def default_debug(self):
 		return int(ucr.get('umc/module/debug/level', 2))
@@ -66,12 +84,22 @@ class ModuleDaemon(Daemon):
 		parser = ArgumentParser()
 		add = parser.add_argument
 		add(
-			'socket', type=str, action='store',
+			'socket', type=str, action='store', nargs='?',
 			help='defines the socket to bind to'
 		)
 		add(
-			'module', type=str, action='store',
-			help='set the UMC daemon module to load'
+			'module', type=str, action='store', nargs='?',
+			help='set the UMC daemon module to load; a comma separated list hosts several modules in one process'
+		)
+		add(
+			'-p', '--prefork', default=False,
+			action='store_true', dest='prefork',
+			help='preload common libraries and wait for the socket and module to be assigned on stdin'
+		)
+		add(
+			'--ready-fd', default=None,
+			action='store', type=int, dest='ready_fd',
+			help='file descriptor on which the readiness is reported when the socket is bound'
 		)
 		add(
 			'-l', '--language', default='C',
@@ -100,11 +128,14 @@ class ModuleDaemon(Daemon):
 		)
 		self.options = parser.parse_args()
 
+		if not self.options.prefork and not (self.options.socket and self.options.module):
+			parser.error('socket and module are required')
+
 		if getuid() != 0:
 			parser.error('%s must be started as root' % basename(sys.argv[0]))
 
 	def listen(self):
-		server = ModuleServer(self.options.module)
+		server = ModuleServer(self.modules, self.options.acls or '%s.acls' % (self.options.socket,))
 
 		# ensure that the UNIX socket is only accessable by root
 		old_umask = umask(0077)
@@ -113,13 +144,46 @@ class ModuleDaemon(Daemon):
 		finally:
 			umask(old_umask)
 
+		self.notify_ready()
 		notifier.loop()
 
+	def notify_ready(self):
+		"""Tells umc-server that the module is loaded and accepts connections"""
+		if self.options.ready_fd is None:
+			return
+		try:
+			write(self.options.ready_fd, '%s\n' % (json.dumps(dict(ready=True, pid=getpid())),))
+			close(self.options.ready_fd)
+		except OSError as exc:
+			MODULE.warn('Could not report readiness: %s' % (exc,))
+
 	def main(self):
 		super(ModuleDaemon, self).main()
+		if self.options.prefork:
+			self.preload()
+			self.wait_for_assignment()
 		self.set_locale()
 		self.init_notifier()
 
+	def preload(self):
+		"""Imports the libraries most modules need before a module is assigned"""
+		preload(self.preload_modules)
+
+	def wait_for_assignment(self):
+		"""Blocks until umc-server assigns a module to this prefork process"""
+		line = sys.stdin.readline()
+		if not line:
+			# umc-server closed the pipe: the idle process is not needed anymore
+			raise SystemExit(0)
+
+		assignment = json.loads(line)
+		self.options.socket = assignment['socket'].encode('UTF-8')
+		self.options.module = assignment['module'].encode('UTF-8')
+		self.options.language = assignment['language'].encode('UTF-8')
+		self.options.debug = int(assignment['debug'])
+		sys.stdin.close()
+		self.init_logging()
+
 	def set_locale(self):
 		set_locale(self.options.language)
 
@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+#
+# Univention Management Console
+#
+# Copyright 2014 Univention GmbH
+#
+# http://www.univention.de/
+#
+# All rights reserved.
+#
+# The source code of this program is made available
+# under the terms of the GNU Affero General Public License version 3
+# (GNU AGPL V3) as published by the Free Software Foundation.
+#
+# Binary versions of this program provided by Univention to you as
+# well as other copyrighted, protected or trademarked materials like
+# Logos, graphics, fonts, specific documentations and configurations,
+# cryptographic keys etc. are subject to a license agreement between
+# you and Univention and not subject to the GNU AGPL V3.
+#
+# In the case you use this program under the terms of the GNU AGPL V3,
+# the program is provided in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public
+# License with the Debian GNU/Linux or Univention distribution in file
+# /usr/share/common-licenses/AGPL-3; if not, see
+# <http://www.gnu.org/licenses/>.
+
+from io import BytesIO
+
+from twisted.internet.protocol import Protocol
+from twisted.web.server import NOT_DONE_YET
+
+from univention.umc.util import MODULE, Translation
+from univention.umc.util.framing import MAGIC, FramedProtocol
+from univention.umc.module.request import ModuleRequestBase
+
+__all__ = ['ProtocolSniffer']
+
+
+class ProtocolSniffer(Protocol):
+	"""Hands the connection to the framed protocol or to HTTP depending on its first bytes"""
+
+	def __init__(self, site, addr):
+		self.site = site
+		self.addr = addr
+		self.buffer = b''
+
+	def dataReceived(self, data):
+		self.buffer += data
+		if len(self.buffer) < len(MAGIC) and MAGIC.startswith(self.buffer):
+			return
+
+		if self.buffer.startswith(MAGIC):
+			protocol = FramedModuleChannel(self.site)
+			data = self.buffer[len(MAGIC):]
+		else:
+			protocol = self.site.buildHTTPProtocol(self.addr)
+			data = self.buffer
+
+		self.transport.protocol = protocol
+		protocol.makeConnection(self.transport)
+		if data:
+			protocol.dataReceived(data)
+
+
+class FramedModuleChannel(FramedProtocol):
+
+	def __init__(self, site):
+		self.site = site
+		self.session_headers = {}
+		# there is no session to adapt; the concrete class does not use it
+		self.translation = Translation(None)
+
+	def frame_session(self, headers):
+		MODULE.info('Received session data')
+		self.session_headers = headers
+
+	def frame_request(self, request_id, path, headers, body):
+		FramedRequest(self, request_id, path, headers, body).process()
+
+
+class FramedRequest(ModuleRequestBase):
+	"""A request received over the framed protocol. Provides the part of the twisted Request interface the module uses."""
+
+	@property
+	def translation(self):
+		return self.channel.translation
+
+	def __init__(self, channel, request_id, path, headers, body):
+		self.channel = channel
+		self.site = channel.site
+		self.request_id = request_id
+		self.uri = path
+		self.path = path.partition('?')[0]
+		self.headers = headers
+		# a later session frame must not change the user of this request
+		self.session_headers = dict(channel.session_headers)
+		self.content = BytesIO(body)
+		self.code = 200
+		self.response_headers = {}
+		self.body = []
+		self.finished = False
+
+	def process(self):
+		self.execute(self.site.resource)
+
+	def render_resource(self, resource):
+		body = resource.render(self)
+		if body is not NOT_DONE_YET:
+			self.write(body)
+			self.finish()
+
+	def getHeader(self, name):
+		name = name.lower()
+		return self.headers.get(name, self.session_headers.get(name))
+
+	def getUser(self):
+		return self.__get_credentials()[0]
+
+	def getPassword(self):
+		return self.__get_credentials()[1]
+
+	def __get_credentials(self):
+		scheme, _, credentials = (self.getHeader('Authorization') or '').partition(' ')
+		if scheme.lower() != 'basic':
+			return '', ''
+		username, _, password = credentials.decode('base64').partition(':')
+		return username, password
+
+	def setResponseCode(self, code, message=None):
+		self.code = code
+
+	def setHeader(self, name, value):
+		self.response_headers[name] = value
+
+	def write(self, data):
+		self.body.append(data)
+
+	def finish(self):
+		if self.finished:
+			return
+		self.finished = True
+		self.channel.sendFrame('response', self.request_id, self.code, self.response_headers, b''.join(self.body))
@@ -43,10 +43,18 @@ from univention.management.console.protocol.message import Request as UmcpReques
 
 from univention.umc import Translation
 from univention.umc.util import MODULE_ERR_COMMAND_FAILED, MODULE, change_locale
-from univention.umc.authentication.acl import ACLs  # TODO: don't use internals
 
 
-class ModuleRequest(Request):
+class ModuleRequestBase(object):
+	"""Executes a command of the module; shared by HTTP and framed requests"""
+
+	@property
+	def module(self):
+		return self.getHeader('X-UMC-Module')
+
+	@property
+	def handler(self):
+		return self.site.get_handler(self.module)
 
 	def get_umcp_request(self, umcptype, command):
 		options = simplejson.load(self.content)
@@ -56,19 +64,27 @@ class ModuleRequest(Request):
 		umcprequest = UmcpRequest(umcptype, [command], options, mimetype)
 		umcprequest.flavor = flavor
 
-		self.site.handler._Base__requests[umcprequest.id] = (umcprequest, method)
+		self.handler._Base__requests[umcprequest.id] = (umcprequest, method)
 		self.site.requests[umcprequest.id] = self
 
 		return umcprequest
 
-	def render(self, resource):
+	def render_resource(self, resource):  # pragma: no-cover
+		raise NotImplementedError
+
+	def execute(self, resource):
 		message = None
 		result = ''
 		method = self.getHeader('X-UMC-Method')
-		_ = self.getSession(Translation)._  # TODO: this runs in the module process so it can be a global
+		_ = self.translation._  # TODO: this runs in the module process so it can be a global
+		if not self.site.is_hosted(self.module):
+			MODULE.warn('Module %s is not hosted by this process' % (self.module,))
+			self.setResponseCode(404)
+			self.finish()
+			return
 		try:
 			self.site.initialize(self)
-			return Request.render(self, resource)
+			return self.render_resource(resource)
 		except UMC_OptionSanitizeError as exc:
 			self.setResponseCode(409)  # Conflict  # HTTP FIXME
 			message = exc.message
@@ -100,11 +116,13 @@ class ModuleRequest(Request):
 		self.finish()
 
 	def initialize(self):
-		handler = self.site.handler
+		handler = self.handler
 		handler.username = self.getUser()
 		handler.password = self.getPassword()
 		handler.user_dn = self.getHeader('X-User-Dn')
-		handler.acls = ACLs(acls=json.loads(self.getHeader('X-UMC-Acls')))  # TODO: load ACL's from filename
+
+	def set_acls(self):
+		self.handler.acls = self.site.get_acls(self.getHeader('X-UMC-Acls-Version'))
 
 	def set_language(self):
 		locale = self.getHeader('Accept-Language')
@@ -112,4 +130,17 @@ class ModuleRequest(Request):
 		MODULE.process('Setting language to %r' % (locale,))
 		if not change_locale(locale):
 			locale = 'C'
-		self.site.handler.set_language(locale)
+		self.handler.set_language(locale)
+
+
+class ModuleRequest(ModuleRequestBase, Request):
+
+	@property
+	def translation(self):
+		return self.getSession(Translation)
+
+	def render(self, resource):
+		return self.execute(resource)
+
+	def render_resource(self, resource):
+		return Request.render(self, resource)
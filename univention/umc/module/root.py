@@ -45,7 +45,7 @@ class ModuleRoot(Resource):
 	def render(self, request):
 		request.setHeader('Content-Type', 'application/json')
 
-		handler = request.site.handler
+		handler = request.handler
 		method = request.getHeader('X-UMC-Method')
 		umcptype, command = self.get_command(request.path)
 		umcprequest = request.get_umcp_request(umcptype, command)
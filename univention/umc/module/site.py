@@ -37,6 +37,8 @@ from univention.umc.util import MODULE, ucr
 from univention.umc.server.site import ServerSite
 from univention.umc.module.root import ModuleRoot
 from univention.umc.module.request import ModuleRequest
+from univention.umc.module.framed import ProtocolSniffer
+from univention.umc.authentication.acl import ACLs  # TODO: don't use internals
 
 
 class ModuleServer(ServerSite):
@@ -45,30 +47,72 @@ class ModuleServer(ServerSite):
 	def timeout(self):
 		return max(15, int(ucr.get('umc/module/timeout', 300) or 300))
 
-	def __init__(self, module):
+	@property
+	def handler(self):
+		return self.get_handler()
+
+	def __init__(self, modules, acls):
 		ServerSite.__init__(self, ModuleRoot(), timeout=self.timeout)
 		self.requestFactory = ModuleRequest
 		# TODO: add timer which kills process when not receiving request anymore
 
-		self.__initialized = False
-		self.handler = None
-		self.__module = module
-		self.__load_module()
-
+		# in host mode several trusted modules share this process; the first one is loaded at once
+		self.modules = modules
+		self.handlers = {}
+		self.acls_file = acls
+		self.acls = None
+		self.acls_version = None
+		self.__initialized = set()
 		self.requests = dict()
-		self.handler.signal_connect('success', self.__umcp_respond)
-		self.handler.signal_connect('failure', self.__umcp_respond)
+		self.get_handler()
+
+	def buildProtocol(self, addr):
+		# umc-server talks either HTTP or the framed protocol
+		return ProtocolSniffer(self, addr)
+
+	def buildHTTPProtocol(self, addr):
+		return ServerSite.buildProtocol(self, addr)
+
+	def is_hosted(self, module):
+		return module is None or module in self.modules
+
+	def get_handler(self, module=None):
+		"""Returns the handler instance of the given module, importing the module on first use"""
+		module = module or self.modules[0]
+		if not self.is_hosted(module):
+			raise KeyError('Module %s is not hosted by this process' % (module,))
+		handler = self.handlers.get(module)
+		if handler is None:
+			handler = self.__load_module(module)
+			handler.signal_connect('success', self.__umcp_respond)
+			handler.signal_connect('failure', self.__umcp_respond)
+			self.handlers[module] = handler
+		return handler
+
+	def get_acls(self, version):
+		"""Returns the ACLs written by umc-server; they are reread when their version changed"""
+		if version != self.acls_version or self.acls is None:
+			MODULE.info('Reading ACLs %s from %s' % (version, self.acls_file))
+			with open(self.acls_file, 'rb') as fd:
+				acls = json.load(fd)
+			if acls['version'] != version:
+				MODULE.warn('Expected ACLs %s but got %s' % (version, acls['version']))
+			self.acls = ACLs(acls=acls['acls'])
+			self.acls_version = version
+		return self.acls
 
 	def initialize(self, request):
 		request.set_language()
+		request.set_acls()
 
-		if self.__initialized:
+		handler = request.handler
+		if handler in self.__initialized:
 			return
 
 		request.initialize()
 
-		self.__initialized = True
-		self.handler.init()
+		self.__initialized.add(handler)
+		handler.init()
 
 	def reload_server(self):
 		try:
@@ -83,34 +127,31 @@ class ModuleServer(ServerSite):
 		request.setHeader('X-UMC-Message', json.dumps(response.message or ''))
 
 		if response.mimetype != 'application/json':
+			request.setHeader('Content-Type', response.mimetype)
 			request.write(response.body)
 		else:
 			request.write(json.dumps(response.result))
 		request.finish()
 
-	def __load_module(self):
-		modname = self.__module
-		self.__module = None
+	def __load_module(self, modname):
 		MODULE.info('Importing module %r' % (modname,))
 		try:
-			self.__import(modname)
+			module = self.__import(modname)
 		except ImportError as exc:
 			MODULE.error('Failed to import module %s: %s\n%s' % (modname, exc, format_exc()))
 			self.reload_server()  # TODO: should we check module existance in umc-server
 			raise
 
-		self.handler = self.__module.Instance()
+		return module.Instance()
 
 	def __import(self, modname):
 		file_ = 'univention.management.console.modules.%s' % (modname,)
-		self.__module = __import__(file_, [], [], modname)
+		return __import__(file_, [], [], modname)
 
-	def __destroy_handler(self):
+	def __destroy_handlers(self):
 		# TODO: register signal handler which calls handler destroyment
-		if self.handler:
-			self.handler.destroy()
-			del self.handler
-			self.handler = None
+		while self.handlers:
+			self.handlers.popitem()[1].destroy()
 
 	def __del__(self):
-		self.__destroy_handler()
+		self.__destroy_handlers()
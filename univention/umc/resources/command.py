@@ -35,17 +35,18 @@ from io import BytesIO
 from twisted.web.resource import Resource
 from twisted.web.server import NOT_DONE_YET
 from twisted.internet.protocol import Protocol
+from twisted.web.client import ResponseDone
 
-from univention.umc import User, ACLs, Translation
+from univention.umc import User, ACLs, Translation, TooManyProcesses
 from univention.umc.util import (
-	CORE, MODULE, BAD_REQUEST_FORBIDDEN, BAD_REQUEST_NOT_FOUND,
-	require_authentication, UMCModuleProcess as ModuleProcess
+	CORE, MODULE, BAD_REQUEST_FORBIDDEN, BAD_REQUEST_NOT_FOUND, BAD_REQUEST_INVALID_OPTS,
+	require_authentication, module_processes
 )
 
 
 class Command(Resource):
 
-	processpool = dict()
+	processes = module_processes
 
 	not_forwarded_headers = set(map(str.lower, (
 		'Content-Length', 'Transfer-Encoding', 'Trailer',
@@ -59,10 +60,7 @@ class Command(Resource):
 		return Resource.getChild(self, path, request)
 
 	def get_process(self, session, module):
-		self.processpool.setdefault(session, {})
-		if module not in self.processpool[session]:
-			self.processpool[session][module] = ModuleProcess(session, module)
-		return self.processpool[session][module]
+		return self.processes.get(session, module)
 
 	@require_authentication
 	def render(self, request):
@@ -90,19 +88,30 @@ class Command(Resource):
 			request.setResponseCode(BAD_REQUEST_NOT_FOUND)
 			return
 
-		headers = self.get_request_header(request, methodname)
-		body = self.get_request_body(request)
+		headers = self.get_request_header(request, module_name, methodname)
+		try:
+			body = self.get_request_body(request)
+		except ValueError as exc:
+			request.setResponseCode(BAD_REQUEST_INVALID_OPTS)
+			request.setHeader('X-UMC-Message', json.dumps(str(exc)))
+			return
 
 		CORE.info('Passing new request to module %s' % (module_name,))
-		process = self.get_process(session, module_name)
+		try:
+			process = self.get_process(session, module_name)
+		except TooManyProcesses as exc:
+			request.setResponseCode(503)
+			request.setHeader('X-UMC-Message', json.dumps(str(exc)))
+			return
 
+		process.set_acls(ACLs(session))
 		urequest = process.request(request.method, request.uri, headers, body)
 		urequest.addCallback(self.respond, request)
 		urequest.addErrback(self.failed_request, request)
 
 		return NOT_DONE_YET
 
-	def get_request_header(self, request, methodname):
+	def get_request_header(self, request, module_name, methodname):
 		session = request.getSession()
 		user = User(session)
 		translation = Translation(session)
@@ -117,11 +126,27 @@ class Command(Resource):
 			'X-UMC-Flavor': request.getHeader('X-UMC-Flavor', ''),
 			'X-User-Dn': user.userdn or '',
 			'X-UMC-Method': methodname,
-			'X-UMC-Acls': acls.json(),  # TODO: remove, only send filename
+			'X-UMC-Module': module_name,
+			'X-UMC-Acls-Version': acls.version,
 		}
 
 	def get_request_body(self, request):
-		return BytesIO(json.dumps(request.options))
+		return BytesIO(json.dumps(self.resolve_upload_handles(request)))
+
+	def resolve_upload_handles(self, request):
+		"""Replaces the handles of files uploaded with /upload?handle=true by the paths of the files"""
+		options = request.options
+		if not isinstance(options, list):
+			return options
+		resolved = []
+		for option in options:
+			if isinstance(option, dict) and 'handle' in option:
+				option = dict(option)
+				option['tmpfile'] = request.get_upload(option.pop('handle'))
+				if option['tmpfile'] is None:
+					raise ValueError('The uploaded file does not exist.')
+			resolved.append(option)
+		return resolved
 
 	def respond(self, response, request):
 		request.setResponseCode(response.code)
@@ -144,18 +169,47 @@ class Into(Protocol):
 	def __init__(self, request):
 		self.request = request
 		self.is_json = 'application/json' in request.responseHeaders.getRawHeaders('Content-Type', [])
-		self.__buffer = bytearray()
+		self.disconnected = False
+		self.__buffer = []
+
+	def connectionMade(self):
+		if not self.is_json:
+			# stream other content to the client; the module connection is paused while the client is slow
+			self.request.registerProducer(self.transport, True)
+			self.request.notifyFinish().addErrback(self.client_disconnected)
+
+	def client_disconnected(self, failure):
+		self.disconnected = True
+		self.transport.stopProducing()
 
 	def dataReceived(self, bytes_):
-		self.__buffer.extend(bytes_)
+		if self.is_json:
+			self.__buffer.append(bytes_)
+		elif not self.disconnected:
+			self.request.write(bytes_)
 
 	def connectionLost(self, reason):
-		back = bytes(self.__buffer)
+		complete = reason.check(ResponseDone)
+		if not complete:
+			MODULE.error('The response of the module process is incomplete: %s' % (reason.getErrorMessage(),))
+
 		if self.is_json:
-			self.request.respond(dict(result=json.loads(back)))
-		else:
-			self.request.write(back)
+			if not complete:
+				self.request.setResponseCode(500)
+				self.request.respond(dict(result='The module process did not send a complete response'))
+				return
+			# the result is already JSON encoded by the module process
+			self.request.respond_raw(b''.join(self.__buffer))
+			return
+
+		self.request.unregisterProducer()
+		if self.disconnected:
+			return
+		if complete:
 			self.request.finish()
+		else:
+			# the headers are sent already; the client has to notice the truncation
+			self.request.channel.transport.loseConnection()
 
 
 #def _check_module_exists(modulename):
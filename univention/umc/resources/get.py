@@ -36,7 +36,8 @@ from twisted.web.resource import Resource
 from univention.umc import Translation, User, ACLs
 from univention.umc.util import (
 	require_authentication, CORE, ucr, BAD_REQUEST_INVALID_OPTS,
-	get_machine_connection, get_ucs_version, get_umc_version
+	get_machine_connection, get_ucs_version, get_umc_version,
+	metrics, BAD_REQUEST_FORBIDDEN
 )
 
 
@@ -50,6 +51,7 @@ class Get(Resource):
 		self.putChild('hosts', Hosts())
 		self.putChild('ucr', UCR())
 		self.putChild('info', Info())
+		self.putChild('metrics', Metrics())
 
 
 class Modules(Resource):
@@ -64,8 +66,6 @@ class Modules(Resource):
 
 		moduleManager = request.site.moduleManager
 		categoryManager = request.site.categoryManager
-		moduleManager.load()
-		categoryManager.load()
 		permitted_commands = acls.get_permitted_commands(moduleManager).values()
 
 		modules = [
@@ -131,7 +131,6 @@ class Categories(Resource):
 	@require_authentication
 	def render(self, request):
 		categoryManager = request.site.categoryManager
-		categoryManager.load()
 		return dict(
 			categories=categoryManager.all()
 		)
@@ -218,3 +217,17 @@ class Info(Resource):
 			ssl_validity_host=validity_host,
 			ssl_validity_root=validity_root
 		))
+
+
+class Metrics(Resource):
+	#'/get/metrics'
+
+	isLeaf = True
+
+	@require_authentication
+	def render(self, request):
+		# internal details of the server; only for monitoring on the host itself
+		if request.getClientIP() not in ('127.0.0.1', '::1', None):
+			request.setResponseCode(BAD_REQUEST_FORBIDDEN)
+			return
+		return dict(result=metrics.json())
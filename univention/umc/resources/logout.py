@@ -37,4 +37,6 @@ class Logout(Resource):
 
 	@require_authentication
 	def render_GET(self, request):
-		request.getSession().expire()
+		session = request.getSession()
+		request.site.session_store.logout(session)
+		session.expire()
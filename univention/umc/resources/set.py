@@ -66,6 +66,8 @@ class Locale(Resource):
 		locale = request.options['locale']
 		if not translation.set_language(locale):
 			request.setResponseCode(BAD_REQUEST_UNAVAILABLE_LOCALE)  # HTTP FIXME
+			return
+		request.save_session()
 
 
 class UserPreferences(Resource):
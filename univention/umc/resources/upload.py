@@ -29,11 +29,37 @@
 # /usr/share/common-licenses/AGPL-3; if not, see
 # <http://www.gnu.org/licenses/>.
 
+import json
+from os import stat
+from os.path import basename
+from base64 import b64encode
+
 from twisted.web.resource import Resource
+from twisted.web.server import NOT_DONE_YET
 
-from base64 import b64encode
 from univention.umc.util import require_authentication
 
+CHUNK_SIZE = 3 * 16384  # a multiple of 3 so that the chunks can be encoded independently
+
+
+class Base64File(object):
+	"""Encodes a file chunk by chunk"""
+
+	def __init__(self, filename):
+		self.filename = filename
+		self.size = stat(filename).st_size
+
+	def __len__(self):
+		return (self.size + 2) // 3 * 4
+
+	def __iter__(self):
+		with open(self.filename, 'rb') as fd:
+			while True:
+				data = fd.read(CHUNK_SIZE)
+				if not data:
+					break
+				yield b64encode(data)
+
 
 # TODO: break API: remove files after request is done
 class Upload(Resource):
@@ -49,13 +75,30 @@ class Upload(Resource):
 
 	@require_authentication
 	def render(self, request):
-		return dict(result=[self._get_result(body) for body in request.options])
-
-	def _get_result(self, body):
-		with open(body['tmpfile']) as fd:
-			content = b64encode(fd.read())
-			return dict(
-				filename=body['filename'],
-				name=body['name'],
-				content=content
-			)
+		if self._is_handle_requested(request):
+			return dict(result=[self._get_handle(body) for body in request.options])
+
+		# the file contents are encoded while they are written to the client
+		request.respond_stream(self._get_result(request.options))
+		return NOT_DONE_YET
+
+	def _is_handle_requested(self, request):
+		return request.args.get('handle', request.body.get('handle')) in ('true', '1')
+
+	def _get_handle(self, body):
+		# the path of the temporary file is not revealed; commands resolve the handle
+		return dict(
+			filename=body['filename'],
+			name=body['name'],
+			handle=basename(body['tmpfile'])
+		)
+
+	def _get_result(self, options):
+		yield b'['
+		for i, body in enumerate(options):
+			if i:
+				yield b', '
+			yield b'{"filename": %s, "name": %s, "content": "' % (json.dumps(body['filename']), json.dumps(body['name']))
+			yield Base64File(body['tmpfile'])
+			yield b'"}'
+		yield b']'
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+#
+# Univention Management Console
+#
+# Copyright 2014 Univention GmbH
+#
+# http://www.univention.de/
+#
+# All rights reserved.
+#
+# The source code of this program is made available
+# under the terms of the GNU Affero General Public License version 3
+# (GNU AGPL V3) as published by the Free Software Foundation.
+#
+# Binary versions of this program provided by Univention to you as
+# well as other copyrighted, protected or trademarked materials like
+# Logos, graphics, fonts, specific documentations and configurations,
+# cryptographic keys etc. are subject to a license agreement between
+# you and Univention and not subject to the GNU AGPL V3.
+#
+# In the case you use this program under the terms of the GNU AGPL V3,
+# the program is provided in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public
+# License with the Debian GNU/Linux or Univention distribution in file
+# /usr/share/common-licenses/AGPL-3; if not, see
+# <http://www.gnu.org/licenses/>.
+
+from twisted.web.http import HTTPChannel
+
+__all__ = ['UMCChannel']
+
+
+class UMCChannel(HTTPChannel):
+	"""A HTTP connection which is kept alive by the proxy.
+
+	The idle timeout only applies between requests, so that long running commands are not aborted.
+	Reading is paused while too many pipelined requests are pending.
+	"""
+
+	paused = False
+	draining = False
+
+	def connectionMade(self):
+		HTTPChannel.connectionMade(self)
+		self.factory.channels.add(self)
+
+	def connectionLost(self, reason):
+		HTTPChannel.connectionLost(self, reason)
+		self.factory.channels.discard(self)
+		self.factory.notify_on_channel_closed()
+
+	def drain(self):
+		"""Closes the connection after the pending requests are answered"""
+		self.draining = True
+		self.persistent = False
+		if not self.requests:
+			self.transport.loseConnection()
+
+	def allContentReceived(self):
+		HTTPChannel.allContentReceived(self)
+		if not self.connected or not self.requests:
+			return  # the request was already answered
+		self.setTimeout(None)
+		if len(self.requests) >= self.factory.max_pipelined_requests and not self.paused:
+			self.paused = True
+			self.transport.pauseProducing()
+
+	def requestDone(self, request):
+		HTTPChannel.requestDone(self, request)
+		if self.paused and len(self.requests) < self.factory.max_pipelined_requests:
+			self.paused = False
+			self.transport.resumeProducing()
+		if not self.requests:
+			if self.draining:
+				self.transport.loseConnection()
+				return
+			self.setTimeout(self.timeOut)
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+#
+# Univention Management Console
+#
+# Copyright 2014 Univention GmbH
+#
+# http://www.univention.de/
+#
+# All rights reserved.
+#
+# The source code of this program is made available
+# under the terms of the GNU Affero General Public License version 3
+# (GNU AGPL V3) as published by the Free Software Foundation.
+#
+# Binary versions of this program provided by Univention to you as
+# well as other copyrighted, protected or trademarked materials like
+# Logos, graphics, fonts, specific documentations and configurations,
+# cryptographic keys etc. are subject to a license agreement between
+# you and Univention and not subject to the GNU AGPL V3.
+#
+# In the case you use this program under the terms of the GNU AGPL V3,
+# the program is provided in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public
+# License with the Debian GNU/Linux or Univention distribution in file
+# /usr/share/common-licenses/AGPL-3; if not, see
+# <http://www.gnu.org/licenses/>.
+
+import zlib
+
+__all__ = ['accepts_gzip', 'gzip_compress', 'GzipDecoder']
+
+GZIP_WBITS = 16 + zlib.MAX_WBITS
+
+
+def accepts_gzip(accept_encoding):
+	"""Whether the Accept-Encoding header allows a gzip encoded response"""
+	for coding in (accept_encoding or '').split(','):
+		coding, _, params = coding.partition(';')
+		if coding.strip().lower() not in ('gzip', 'x-gzip', '*'):
+			continue
+		params = dict(param.strip().partition('=')[::2] for param in params.split(';') if param.strip())
+		try:
+			return float(params.get('q', 1)) > 0
+		except ValueError:
+			return False
+	return False
+
+
+def gzip_compress(data, level=6):
+	compressor = zlib.compressobj(level, zlib.DEFLATED, GZIP_WBITS)
+	return compressor.compress(data) + compressor.flush()
+
+
+class GzipDecoder(object):
+	"""Decompresses a gzip stream chunk by chunk and refuses to inflate it beyond max_size bytes"""
+
+	def __init__(self, max_size):
+		self.decompressor = zlib.decompressobj(GZIP_WBITS)
+		self.max_size = max_size
+		self.size = 0
+
+	def decompress(self, data):
+		try:
+			# never inflate more than one byte beyond the limit
+			data = self.decompressor.decompress(data, self.max_size - self.size + 1)
+		except zlib.error as exc:
+			raise ValueError('The gzip encoded request body is invalid: %s' % (exc,))
+		self.size += len(data)
+		if self.size > self.max_size:
+			raise OverflowError('The decompressed request body is too large.')
+		return data
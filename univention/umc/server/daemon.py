@@ -32,19 +32,30 @@
 from __future__ import absolute_import
 
 import os
-from os import umask
+import sys
+import socket
+from os import umask, kill
+from signal import signal
 from os.path import join
 from argparse import ArgumentParser
 from daemon.daemon import DaemonContext
 
 from twisted.web.server import Session
 from twisted.internet import reactor, ssl
+from twisted.protocols.tls import TLSMemoryBIOFactory
 from twisted.python.components import registerAdapter
 
 from univention.umc import Translation as ITranslation, User, ACLs
-from univention.umc.util import log_init, ucr, Translation
+from univention.umc.util import log_init, ucr, Translation, CORE
+from univention.umc.util.process import prefork_pool, zygote
+from univention.umc.util.registry import module_processes
 from univention.umc.authentication import PAMAuthenticatedUser, LdapACLs
 from univention.umc.server.site import Server
+from univention.umc.server.uploads import upload_janitor
+from univention.umc.server.supervisor import WorkerSupervisor, bind_tcp, bind_unix
+from univention.umc.server.upgrade import (
+	UPGRADE_SIGNAL, NewServer, write_pidfile, read_pidfile, remove_pidfile, UNIXPort, stop_listening, drain
+)
 
 
 class Daemon(object):
@@ -114,10 +125,40 @@ class ServerDaemon(Daemon):
 	def interface(self):
 		return ucr.get('umc/http/interface', '127.0.0.1')
 
+	@property
+	def unix_socket(self):
+		return ucr.get('umc/http/unix_socket')
+
+	@property
+	def workers(self):
+		workers = max(1, int(ucr.get('umc/server/workers', 1)))
+		if workers > 1:
+			# module processes belong to the worker which started them, but the requests of a session reach every worker
+			CORE.error('umc/server/workers=%d is not supported: module processes can not be shared between workers; starting one process' % (workers,))
+			return 1
+		return workers
+
+	@property
+	def drain_timeout(self):
+		return int(ucr.get('umc/server/upgrade/drain_timeout', 300))
+
 	@property
 	def logfile(self):
 		return self.options.logfile
 
+	@property
+	def server_args(self):
+		return ['-n', '-d', str(self.options.debug), '-l', self.options.language, '-L', self.options.logfile]
+
+	def __init__(self):
+		self.command = os.path.abspath(sys.argv[0])
+		self.server = None
+		self.ports = []
+		self.supervisor = None
+		self.upgrading = False
+		self.snapshot_trigger = None
+		super(ServerDaemon, self).__init__()
+
 	def clear_environment(self):
 		super(ServerDaemon, self).clear_environment()
 		os.environ['LANG'] = self.default_locale
@@ -151,6 +192,26 @@ class ServerDaemon(Daemon):
 			action='store', dest='logfile',
 			help='specifies an alternative log file [default: %(default)s]'
 		)
+		add(
+			'--listen-fds', default=None,
+			action='store', dest='listen_fds',
+			help='serve the inherited listening sockets (TCP, SSL and optionally UNIX); used by the worker supervisor and upgrades'
+		)
+		add(
+			'--worker', default=False,
+			action='store_true', dest='worker',
+			help='run as worker of the supervisor'
+		)
+		add(
+			'--ready-fd', default=None,
+			action='store', type=int, dest='ready_fd',
+			help='the file descriptor on which readiness is reported'
+		)
+		add(
+			'--upgrade', default=False,
+			action='store_true', dest='upgrade',
+			help='replace the running umc-server by a new process without refusing connections'
+		)
 		self.options = parser.parse_args()
 
 	def daemonize(self):
@@ -158,13 +219,157 @@ class ServerDaemon(Daemon):
 			super(ServerDaemon, self).daemonize()
 
 	def listen(self):
-		server = Server()
-		self.listen_ssl(server)
-		reactor.listenTCP(self.options.port, server, interface=self.interface)
+		if self.options.upgrade:
+			return self.request_upgrade()
+		if not self.options.worker and self.workers > 1:
+			return self.supervise()
+
+		self.server = server = Server()
+		if self.options.listen_fds is not None:
+			self.ports = self.adopt_sockets(server)
+		else:
+			self.ports = [
+				reactor.listenTCP(self.options.port, server, interface=self.interface),
+				self.listen_ssl(server),
+			] + self.listen_unix(server)
+		self.start_module_spawner()
+		self.start_module_registry()
+		self.start_upload_janitor()
+		self.start_session_store(server)
+		self.start_upgrade_handler()
 		reactor.run()
 
+	def supervise(self):
+		# the reactor is already installed so the workers are executed instead of forked
+		if self.options.listen_fds is not None:
+			sockets = self.inherit_sockets()
+		else:
+			sockets = [bind_tcp(self.interface, self.options.port), bind_tcp(self.interface, self.ssl_port)]
+			if self.unix_socket:
+				sockets.append(bind_unix(self.unix_socket))
+
+		self.ports = sockets
+		self.supervisor = WorkerSupervisor(self.command, self.server_args + ['--worker'], sockets, self.workers)
+		reactor.callWhenRunning(self.supervisor.start)
+		reactor.addSystemEventTrigger('before', 'shutdown', self.supervisor.stop)
+		self.start_upgrade_handler()
+		reactor.run()
+
+	def get_listen_fds(self):
+		fds = [int(fd) for fd in self.options.listen_fds.split(',')]
+		family = socket.AF_INET6 if ':' in self.interface else socket.AF_INET
+		return zip(fds, [family, family] + [socket.AF_UNIX] * (len(fds) - 2))
+
+	def inherit_sockets(self):
+		sockets = []
+		for fd, family in self.get_listen_fds():
+			sockets.append(socket.fromfd(fd, family, socket.SOCK_STREAM))
+			os.close(fd)  # fromfd() duplicated it
+		return sockets
+
+	def adopt_sockets(self, server):
+		ports = []
+		for i, (fd, family) in enumerate(self.get_listen_fds()):
+			factory = TLSMemoryBIOFactory(self.get_ssl_context(), False, server) if i == 1 else server
+			if family == socket.AF_UNIX:
+				# like reactor.adoptStreamPort() but with a port which can keep the socket file
+				port = UNIXPort._fromListeningDescriptor(reactor, fd, factory)
+				port.startListening()
+			else:
+				port = reactor.adoptStreamPort(fd, family, factory)
+			ports.append(port)
+			os.close(fd)  # the port has duplicated it
+		return ports
+
+	def start_upgrade_handler(self):
+		signal(UPGRADE_SIGNAL, lambda signo, frame: reactor.callFromThread(self.upgrade))
+		reactor.callWhenRunning(self.notify_ready)
+
+	def notify_ready(self):
+		"""Tells the previous umc-server that the sockets are served now"""
+		if not self.options.worker:
+			write_pidfile()
+			reactor.addSystemEventTrigger('after', 'shutdown', remove_pidfile)
+		if self.options.ready_fd is None:
+			return
+		try:
+			os.write(self.options.ready_fd, 'ready\n')
+			os.close(self.options.ready_fd)
+		except OSError as exc:
+			CORE.warn('Could not report readiness: %s' % (exc,))
+
+	def request_upgrade(self):
+		pid = read_pidfile()
+		if pid is None:
+			raise SystemExit('umc-server is not running')
+		kill(pid, UPGRADE_SIGNAL)
+
+	def upgrade(self):
+		"""Hands the listening sockets to a new umc-server; stops once it is ready and the requests are answered"""
+		if self.upgrading:
+			return
+		self.upgrading = True
+		if self.options.worker:
+			# the supervisor has started new workers
+			return self.hand_over(None)
+
+		CORE.process('Upgrade: starting new umc-server')
+		if self.server is not None:
+			# the new server restores the sessions when it starts
+			self.server.session_store.snapshot()
+			reactor.removeSystemEventTrigger(self.snapshot_trigger)
+		started = NewServer(self.ports).spawn(self.command, self.server_args)
+		started.addCallbacks(self.hand_over, self.upgrade_failed)
+
+	def hand_over(self, pid):
+		if self.supervisor is not None:
+			CORE.process('Upgrade: stopping workers')
+			stopped = self.supervisor.drain()
+		else:
+			CORE.process('Upgrade: draining connections')
+			for port in self.ports:
+				stop_listening(port)
+			stopped = drain(self.server, self.drain_timeout)
+		stopped.addBoth(lambda result: reactor.stop())
+
+	def upgrade_failed(self, failure):
+		CORE.error('Upgrade failed; the new umc-server did not start: %s' % (failure.getErrorMessage(),))
+		self.upgrading = False
+		if self.server is not None:
+			self.snapshot_trigger = reactor.addSystemEventTrigger('before', 'shutdown', self.server.session_store.snapshot)
+
+	def start_module_spawner(self):
+		# the zygote replaces the prefork processes, both fall back to executing umc-module
+		spawner = zygote if zygote.enabled else prefork_pool
+		reactor.callWhenRunning(spawner.start)
+		reactor.addSystemEventTrigger('before', 'shutdown', spawner.stop)
+
+	def start_module_registry(self):
+		reactor.callWhenRunning(module_processes.start)
+		reactor.addSystemEventTrigger('before', 'shutdown', module_processes.stop)
+
+	def start_session_store(self, server):
+		reactor.callWhenRunning(server.session_store.restore_snapshot)
+		self.snapshot_trigger = reactor.addSystemEventTrigger('before', 'shutdown', server.session_store.snapshot)
+
+	def start_upload_janitor(self):
+		reactor.callWhenRunning(upload_janitor.start)
+		reactor.addSystemEventTrigger('before', 'shutdown', upload_janitor.stop)
+
+	def listen_unix(self, server):
+		# the local reverse proxy may connect through a UNIX socket instead of TCP
+		if not self.unix_socket:
+			return []
+		if os.path.exists(self.unix_socket):
+			os.unlink(self.unix_socket)
+		port = UNIXPort(self.unix_socket, server, mode=0666, reactor=reactor)
+		port.startListening()
+		return [port]
+
 	def listen_ssl(self, server):
 		# TODO: do we need also verified ssl connections (e.g. Single Sign On)?
+		return reactor.listenSSL(self.ssl_port, server, self.get_ssl_context(), interface=self.interface)
+
+	def get_ssl_context(self):
 		ssldir = '/etc/univention/ssl/%s.%s/' % (ucr['hostname'], ucr['domainname'])
-		sslserver = ssl.DefaultOpenSSLContextFactory(join(ssldir, 'private.key'), join(ssldir, 'cert.pem'))
-		reactor.listenSSL(self.ssl_port, server, sslserver, interface=self.interface)
+		return ssl.DefaultOpenSSLContextFactory(join(ssldir, 'private.key'), join(ssldir, 'cert.pem'))
@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+#
+# Univention Management Console
+#
+# Copyright 2014 Univention GmbH
+#
+# http://www.univention.de/
+#
+# All rights reserved.
+#
+# The source code of this program is made available
+# under the terms of the GNU Affero General Public License version 3
+# (GNU AGPL V3) as published by the Free Software Foundation.
+#
+# Binary versions of this program provided by Univention to you as
+# well as other copyrighted, protected or trademarked materials like
+# Logos, graphics, fonts, specific documentations and configurations,
+# cryptographic keys etc. are subject to a license agreement between
+# you and Univention and not subject to the GNU AGPL V3.
+#
+# In the case you use this program under the terms of the GNU AGPL V3,
+# the program is provided in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public
+# License with the Debian GNU/Linux or Univention distribution in file
+# /usr/share/common-licenses/AGPL-3; if not, see
+# <http://www.gnu.org/licenses/>.
+
+from os import unlink
+from cgi import parse_header
+from tempfile import NamedTemporaryFile
+
+__all__ = ['MultipartParser']
+
+PREAMBLE, BOUNDARY, HEADERS, BODY, EPILOGUE = range(5)
+MAX_HEADER_SIZE = 16 * 1024
+CHECK_SPACE_INTERVAL = 1024 * 1024
+
+
+class MultipartPart(object):
+
+	def __init__(self, name, filename, directory):
+		self.name = name
+		self.filename = filename
+		self.size = 0
+		self.tmpfile = None
+		self.value = []
+		if filename:
+			self.tmpfile = NamedTemporaryFile(dir=directory, delete=False)
+
+	def write(self, data):
+		self.size += len(data)
+		if self.tmpfile is not None:
+			self.tmpfile.write(data)
+		else:
+			self.value.append(data)
+
+	def close(self):
+		if self.tmpfile is not None:
+			self.tmpfile.close()
+		self.value = b''.join(self.value)
+
+	def remove(self):
+		if self.tmpfile is not None:
+			self.tmpfile.close()
+			try:
+				unlink(self.tmpfile.name)
+			except OSError:
+				pass
+
+
+class MultipartParser(object):
+	"""Incremental parser for multipart/form-data bodies which writes the uploaded files directly into temporary files.
+
+	check_size(size) and check_space(filename) are called while a part is written;
+	they raise ValueError to abort the upload.
+	"""
+
+	def __init__(self, boundary, directory, check_size, check_space):
+		self.delimiter = b'\r\n--%s' % (boundary,)
+		self.directory = directory
+		self.check_size = check_size
+		self.check_space = check_space
+		self.buffer = b'\r\n'  # the first delimiter is not preceded by a line break
+		self.state = PREAMBLE
+		self.parts = []
+		self.part = None
+		self.checked = 0
+		self.error = None
+		self.closed = False
+
+	def feed(self, data):
+		if self.error is not None:
+			return
+		self.buffer += data
+		try:
+			self.__parse()
+		except ValueError as exc:
+			self.error = exc
+			self.remove()
+
+	def close(self):
+		"""Finishes parsing and raises the error which aborted the upload"""
+		self.closed = True
+		if self.error is None and self.state != EPILOGUE:
+			self.error = ValueError('The multipart body is incomplete.')
+			self.remove()
+		if self.error is not None:
+			raise self.error
+
+	def remove(self):
+		"""Removes all temporary files"""
+		for part in self.parts:
+			part.remove()
+		self.buffer = b''
+
+	@property
+	def fields(self):
+		return [part for part in self.parts if not part.filename]
+
+	@property
+	def files(self):
+		return [part for part in self.parts if part.filename]
+
+	def __parse(self):
+		while True:
+			if self.state == PREAMBLE:
+				index = self.buffer.find(self.delimiter)
+				if index < 0:
+					self.buffer = self.buffer[-len(self.delimiter):]
+					return
+				self.buffer = self.buffer[index + len(self.delimiter):]
+				self.state = BOUNDARY
+			elif self.state == BOUNDARY:
+				if len(self.buffer) < 2:
+					return
+				if self.buffer.startswith(b'--'):
+					self.state = EPILOGUE
+				elif self.buffer.startswith(b'\r\n'):
+					self.buffer = self.buffer[2:]
+					self.state = HEADERS
+				else:
+					raise ValueError('Invalid multipart boundary.')
+			elif self.state == HEADERS:
+				index = self.buffer.find(b'\r\n\r\n')
+				if index < 0:
+					if len(self.buffer) > MAX_HEADER_SIZE:
+						raise ValueError('The multipart headers are too large.')
+					return
+				self.__start_part(self.buffer[:index])
+				self.buffer = self.buffer[index + 4:]
+				self.state = BODY
+			elif self.state == BODY:
+				index = self.buffer.find(self.delimiter)
+				if index < 0:
+					# keep enough bytes to recognize a delimiter which is split between two chunks
+					keep = len(self.delimiter) - 1
+					if len(self.buffer) > keep:
+						self.__write(self.buffer[:-keep])
+						self.buffer = self.buffer[-keep:]
+					return
+				self.__write(self.buffer[:index])
+				self.__finish_part()
+				self.buffer = self.buffer[index + len(self.delimiter):]
+				self.state = BOUNDARY
+			else:
+				self.buffer = b''
+				return
+
+	def __start_part(self, headers):
+		disposition = {}
+		for line in headers.split(b'\r\n'):
+			name, _, value = line.partition(b':')
+			if name.strip().lower() == b'content-disposition':
+				disposition = parse_header(value.strip())[1]
+		if 'name' not in disposition:
+			raise ValueError('A multipart part has no name.')
+		self.part = MultipartPart(disposition['name'], disposition.get('filename'), self.directory)
+		self.parts.append(self.part)
+		self.checked = 0
+
+	def __write(self, data):
+		if not data:
+			return
+		self.part.write(data)
+		self.check_size(self.part.size)
+		if self.part.tmpfile is not None and self.part.size - self.checked >= CHECK_SPACE_INTERVAL:
+			self.checked = self.part.size
+			self.check_space(self.part.tmpfile.name)
+
+	def __finish_part(self):
+		if self.part.tmpfile is not None:
+			self.check_space(self.part.tmpfile.name)
+		self.part.close()
+		self.part = None
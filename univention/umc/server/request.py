@@ -29,29 +29,33 @@
 # <http://www.gnu.org/licenses/>.
 
 import json
+from io import BytesIO
 from hashlib import sha256
-from os import stat, statvfs
+from os import statvfs
 from datetime import datetime
-from tempfile import NamedTemporaryFile
 from types import FunctionType, CodeType
-from cgi import FieldStorage
 
-from twisted.web.http import _parseHeader
+from twisted.web.http import _parseHeader, RESPONSES
 from twisted.web.server import Request, NOT_DONE_YET
 from twisted.web.error import UnsupportedMethod
-from twisted.internet import reactor, threads
+from twisted.internet.interfaces import IPullProducer
+from twisted.internet import threads
+from twisted.internet.defer import maybeDeferred
 
 from univention.umc import (
-	User, AuthenticationFailed, NotAuthenticated,
+	implements, User, AuthenticationFailed, NotAuthenticated,
 	PasswordExpired, PasswordChangeFailed
 )
 from univention.umc.util import (
 	ucr, CORE, get_ucs_version, get_umc_version,
 	BAD_REQUEST_UNAUTH, BAD_REQUEST_PASSWORD_EXPIRED,
-	AUTH, BAD_REQUEST_AUTH_FAILED
+	AUTH, BAD_REQUEST_AUTH_FAILED, metrics
 )
+from univention.umc.server.multipart import MultipartParser
+from univention.umc.server.compression import accepts_gzip, gzip_compress, GzipDecoder
+from univention.umc.server.uploads import TEMPUPLOADDIR, upload_janitor
 
-TEMPUPLOADDIR = '/var/tmp/univention-management-console-frontend'
+RATIO_BUCKETS = (0.05, 0.1, 0.2, 0.3, 0.5, 0.75, 1)
 
 _ERRSTATUSES = {
 	PasswordExpired: BAD_REQUEST_PASSWORD_EXPIRED,  # HTTP FIXME
@@ -72,6 +76,9 @@ def get_expiration():
 
 class UMCRequest(Request):
 
+	# the number of uploads in progress per session in this process
+	uploads = dict()
+
 	@property
 	def sso_timeout(self):
 		return int(ucr.get('umc/web/sso/timeout', 15))
@@ -88,6 +95,44 @@ class UMCRequest(Request):
 	def min_free_space(self):
 		return int(ucr.get('umc/server/upload/min_free_space', 51200))  # kilobyte
 
+	@property
+	def max_request_size(self):
+		return int(ucr.get('umc/server/request/max', 10240)) * 1024  # kilobyte
+
+	@property
+	def json_thread_threshold(self):
+		return int(ucr.get('umc/server/request/thread_threshold', 64)) * 1024  # kilobyte
+
+	@property
+	def compression_threshold(self):
+		return int(ucr.get('umc/server/compression/threshold', 1024))  # bytes; 0 disables
+
+	@property
+	def compression_thread_threshold(self):
+		return int(ucr.get('umc/server/compression/thread_threshold', 256)) * 1024  # kilobyte
+
+	@property
+	def compression_level(self):
+		return int(ucr.get('umc/server/compression/level', 6))
+
+	@property
+	def max_session_uploads(self):
+		return int(ucr.get('umc/server/upload/session/max', 5))
+
+	@property
+	def upload_session(self):
+		"""The authenticated session of the upload or None"""
+		# the session must not be created while the request is incomplete
+		uid = self.getCookie('UMCSessionId')
+		if not uid:
+			return
+		try:
+			session = self.channel.site.getSession(uid)
+			User(session).is_authenticated()
+		except (KeyError, NotAuthenticated):
+			return
+		return session
+
 	@property
 	def is_iframe_upload(self):
 		return self.args.get('iframe') not in ('false', False, 0, '0', None) and self.path.startswith('/upload')
@@ -102,13 +147,23 @@ class UMCRequest(Request):
 	def __init__(self, *args, **kwargs):
 		Request.__init__(self, *args, **kwargs)
 		self._authenticated_callbacks = []
+		self.multipart = None
+		self.rejected = False
+		self.rejection = None
+		self.received = 0
+		self.decoder = None
 		self.__fix_twisted()
 		self.notify_on_authenticated(self.__store_ip_in_session)
 		self.notify_on_authenticated(self.__add_sso_session)
+		self.notify_on_authenticated(self.save_session)
 
 	def single_sign_on(self, token):
 		"""Authenticate the client by given single sign on token"""
-		session = self.single_sign_on.sessions.pop(token, None)
+		uid = self.site.session_store.pop_token(token)
+		try:
+			session = self.site.getSession(uid) if uid else None
+		except KeyError:
+			session = None
 		if not session:
 			CORE.warn('Unknown SSO token: %r' % (token,))
 			return False
@@ -119,12 +174,11 @@ class UMCRequest(Request):
 		self.addCookie('UMCSessionId', session.uid, path='/', expires=expiration)
 		self.addCookie('UMCUsername', user.username, path='/', expires=expiration)
 		return True
-	single_sign_on.sessions = dict()
 
 	def getClientIP(self):
 		"""Get the clients IP address. Evaluates allowed proxys (from localhost)"""
 		ip = Request.getClientIP(self)
-		if ip in ('::1', '127.0.0.1'):
+		if ip in ('::1', '127.0.0.1', None):  # None: connected through the UNIX socket
 			return self.requestHeaders.getRawHeaders('X-Forwarded-For', [ip])[-1]
 		return ip
 
@@ -179,8 +233,135 @@ class UMCRequest(Request):
 		if self.path.startswith('/auth') and 'new_password' in self.options:
 			return self.options['new_password'].encode('UTF-8')
 
+	def gotLength(self, length):
+		"""Stream multipart bodies directly into temporary files instead of buffering them"""
+		codec, params = _parseHeader(self.getHeader('content-type', ''))
+		encoding = self.getHeader('content-encoding', 'identity').strip().lower()
+		if encoding not in ('identity', 'gzip', 'x-gzip') or (encoding != 'identity' and codec == 'multipart/form-data'):
+			CORE.warn('Rejecting request body with Content-Encoding %r' % (encoding,))
+			self.reject_early(415, 'Unsupported Content-Encoding.')
+			return
+
+		if codec != 'multipart/form-data' or not params.get('boundary'):
+			if self.content_length > self.max_request_size:
+				CORE.warn('Rejecting request body of size %d' % (self.content_length,))
+				self.reject_early(413, 'The request body is too large.')
+				return
+			if encoding != 'identity':
+				# the decompressed size is limited as well, so that compression bombs are refused
+				self.decoder = GzipDecoder(self.max_request_size)
+				length = None
+			return Request.gotLength(self, length)
+
+		ucr.load()
+		if not self.__admit_upload():
+			return
+
+		self.content = BytesIO()
+		self.multipart = MultipartParser(
+			params['boundary'], TEMPUPLOADDIR,
+			self.__check_max_file_size, self.__check_min_free_space_on_partition
+		)
+
+	def __admit_upload(self):
+		"""Rejects an upload before its body is received if it can not be stored"""
+		try:
+			sfs = statvfs(TEMPUPLOADDIR)
+		except OSError:
+			sfs = None
+		session = self.upload_session
+
+		if session is None:
+			CORE.warn('Rejecting upload without authenticated session')
+			self.reject_early(BAD_REQUEST_UNAUTH, 'For using this request a login is required.')
+		elif self.content_length > self.max_upload_size:
+			CORE.warn('Rejecting upload of size %d' % (self.content_length,))
+			self.reject_early(413, 'The size of the uploaded file is too large.')
+		elif sfs and sfs.f_bavail * sfs.f_frsize / 1024 - self.content_length / 1024 < self.min_free_space:
+			CORE.error('There is not enough free space to upload files.')
+			self.reject_early(507, 'There is not enough free space on disk.')
+		elif upload_janitor.exceeds_quota(self.content_length):
+			CORE.error('The quota of the upload directory is exceeded.')
+			self.reject_early(507, 'The quota for uploaded files is exceeded.')
+		elif self.uploads.get(session.uid, 0) >= self.max_session_uploads:
+			CORE.warn('Rejecting upload: too many concurrent uploads in session')
+			self.reject_early(429, 'There are too many concurrent uploads.')
+		else:
+			self.uploads[session.uid] = self.uploads.get(session.uid, 0) + 1
+			self.notifyFinish().addBoth(self.__upload_finished, session.uid)
+			return True
+		return False
+
+	def __upload_finished(self, result, uid):
+		self.uploads[uid] -= 1
+		if not self.uploads[uid]:
+			del self.uploads[uid]
+
+	def get_upload(self, handle):
+		"""Returns the path of a file uploaded in this session by its handle or None"""
+		return upload_janitor.resolve(handle, self.getSession())
+
+	def reject_early(self, code, message):
+		"""Respond while the request body is still being received and close the connection"""
+		self.content = BytesIO()
+		self.rejected = True
+		if getattr(self, 'queued', False):
+			# the response of an earlier pipelined request is not written yet; stop reading until it is
+			self.rejection = (code, message)
+			self.channel.transport.pauseProducing()
+			return
+		self.__write_rejection(code, message)
+
+	def noLongerQueued(self):
+		Request.noLongerQueued(self)
+		if self.rejection is not None:
+			self.__write_rejection(*self.rejection)
+
+	def __write_rejection(self, code, message):
+		body = json.dumps(dict(message=message, status=code, result=None))
+		transport = self.channel.transport
+		transport.write(b'HTTP/1.1 %d %s\r\nContent-Type: application/json\r\nContent-Length: %d\r\nConnection: close\r\n\r\n%s' % (
+			code, RESPONSES.get(code, b'Error'), len(body), body
+		))
+		transport.loseConnection()
+
+	def handleContentChunk(self, data):
+		if self.rejected:
+			return
+		if self.multipart is not None:
+			self.multipart.feed(data)
+			return
+
+		if self.decoder is not None:
+			try:
+				data = self.decoder.decompress(data)
+			except OverflowError as exc:
+				CORE.warn('Rejecting gzip encoded request body: %s' % (exc,))
+				self.reject_early(413, str(exc))
+				return
+			except ValueError as exc:
+				CORE.warn('Rejecting gzip encoded request body: %s' % (exc,))
+				self.reject_early(400, str(exc))
+				return
+
+		# bodies without Content-Length are limited while they are received
+		self.received += len(data)
+		if self.received > self.max_request_size:
+			CORE.warn('Rejecting request body of more than %d bytes' % (self.max_request_size,))
+			self.reject_early(413, 'The request body is too large.')
+			return
+		Request.handleContentChunk(self, data)
+
+	def connectionLost(self, reason):
+		if self.multipart is not None and not self.multipart.closed:
+			# the client went away during the upload; nobody else knows the partly written files
+			self.multipart.remove()
+		Request.connectionLost(self, reason)
+
 	def requestReceived(self, command, path, version):
 		"""Processes the self"""
+		if self.rejected:
+			return  # reject_early() has already responded
 		CORE.info('Receiving request...')
 		try:
 			# prevent twisted's processing by lowercasing method
@@ -194,18 +375,28 @@ class UMCRequest(Request):
 
 		self._set_default_response_headers()
 
-		try:
-			CORE.info('Parse request body...')
-			self._parse_request_payload()
-		except ValueError as err:
-			self.respond(bytes(err))
-			return
+		CORE.info('Parse request body...')
+		parsed = maybeDeferred(self._parse_request_payload)
+		parsed.addCallbacks(self._payload_parsed, self._payload_failed)
 
+	def _payload_parsed(self, body):
+		self.body = body
 		self._set_default_request_headers()
 
 		CORE.info('Authenticate? ...')
 		self._authenticate_and_process()
 
+	def _payload_failed(self, failure):
+		if failure.check(ValueError):
+			if self.code == 200:
+				self.setResponseCode(400)
+			self.respond(bytes(failure.value))
+			return
+		# e.g. RuntimeError: maximum recursion depth exceeded for deeply nested JSON
+		CORE.error('Could not process the request body: %s' % (failure.getTraceback(),))
+		self.setResponseCode(500)
+		self.respond('The request body could not be processed.')
+
 	def process(self):
 		pass  # !! don't do anything! called by Request.requestReceived
 
@@ -268,28 +459,91 @@ class UMCRequest(Request):
 		"""Write the response body to the client. Convert it into UMCP format."""
 
 		CORE.info('Writing response...')
-		message = self.responseHeaders.getRawHeaders('X-UMC-Message')
-		message = json.loads(message and message[0] or '""')
-
 		if not isinstance(body, dict):
 			body = dict(result=body)
 
 		data = dict(
-			message=message,
+			message=self.get_response_message(),
 			status=self.code,
 		)
 		data.update(body)
 
-		body = json.dumps(data)
+		self.write_response(json.dumps(data))
+
+	def respond_raw(self, result):
+		"""Write an already JSON encoded result to the client without decoding it again."""
+
+		CORE.info('Writing raw response...')
+		envelope = b'{"message": %s, "status": %d, "result": ' % (json.dumps(self.get_response_message()), self.code)
+		self.write_response(envelope, result or b'null', b'}')
+
+	def respond_stream(self, result):
+		"""Write a result whose JSON encoding is produced incrementally.
+
+		result is a sequence of strings and of iterables which know their encoded length and yield strings.
+		"""
+
+		CORE.info('Writing streamed response...')
+		envelope = b'{"message": %s, "status": %d, "result": ' % (json.dumps(self.get_response_message()), self.code)
+		chunks = self.get_response_chunks((envelope,) + tuple(result) + (b'}',))
+		self.setHeader('Content-Length', '%d' % (sum(len(chunk) for chunk in chunks),))
+		ResponseProducer(self, chunks).start()
+
+	def get_response_message(self):
+		message = self.responseHeaders.getRawHeaders('X-UMC-Message')
+		return json.loads(message and message[0] or '""')
+
+	def get_response_chunks(self, chunks):
+		prefix, suffix = (), ()
 		self.setHeader('Content-Type', 'application/json')
-		self.setHeader('Content-Length', '%d' % (len(body),))
 
 		if self.is_iframe_upload:
 			# this is a workaround to make iframe uploads work, they need the textarea field
 			# TODO: break API: remove
 			self.setHeader('Content-Type', 'text/html; charset=UTF-8')
-			body = b'<html><body><textarea>%s</textarea></body></html>' % (body,)
+			prefix, suffix = (b'<html><body><textarea>',), (b'</textarea></body></html>',)
+
+		return prefix + chunks + suffix
+
+	def write_response(self, *chunks):
+		chunks = self.get_response_chunks(chunks)
+		self.setHeader('Vary', 'Accept-Encoding')
+
+		size = sum(len(chunk) for chunk in chunks)
+		threshold = self.compression_threshold
+		if threshold and size >= threshold and accepts_gzip(self.getHeader('Accept-Encoding')):
+			body = b''.join(chunks)
+			if size < self.compression_thread_threshold:
+				return self.__write_compressed(gzip_compress(body, self.compression_level), size)
+			# large bodies would block the reactor while they are compressed
+			compressed = threads.deferToThread(gzip_compress, body, self.compression_level)
+			compressed.addCallbacks(self.__write_compressed, self.__compression_failed, callbackArgs=(size,), errbackArgs=(chunks,))
+			return
+
+		self.__write_uncompressed(chunks)
 
+	def __write_uncompressed(self, chunks):
+		self.setHeader('Content-Length', '%d' % (sum(len(chunk) for chunk in chunks),))
+		for chunk in chunks:
+			self.write(chunk)
+		self.finish()
+
+	def __compression_failed(self, failure, chunks):
+		CORE.error('Compressing the response failed: %s' % (failure.getTraceback(),))
+		if self._disconnected:
+			return
+		self.__write_uncompressed(chunks)
+
+	def __write_compressed(self, body, size):
+		if self._disconnected:
+			# the client went away while the body was compressed in a thread
+			return
+		metrics.counter('response.gzip.bytes_in').increment(size)
+		metrics.counter('response.gzip.bytes_out').increment(len(body))
+		metrics.histogram('response.gzip.ratio', RATIO_BUCKETS).observe(float(len(body)) / size)
+
+		self.setHeader('Content-Encoding', 'gzip')
+		self.setHeader('Content-Length', '%d' % (len(body),))
 		self.write(body)
 		self.finish()
 
@@ -309,20 +563,33 @@ class UMCRequest(Request):
 			if self.content_length:
 				self.setResponseCode(415)
 				raise ValueError('Unknown or unsupported Content-Type.')
-		else:
-			self.body = codec(params)
+			return {}
+		return codec(params)
 
 	def __parse_json(self, params):
 		if not self.content_length:
 			self.setResponseCode(411)
 			raise ValueError('Please provide Content-Length header.')
 
+		if self.received > self.json_thread_threshold:
+			# large payloads would block the reactor while they are parsed
+			content = threads.deferToThread(json.load, self.content)
+			content.addCallbacks(self.__check_json, self.__invalid_json)
+			return content
+
 		try:
 			content = json.load(self.content)
 		except ValueError:
 			self.setResponseCode(400)
 			raise
+		return self.__check_json(content)
+
+	def __invalid_json(self, failure):
+		failure.trap(ValueError)
+		self.setResponseCode(400)
+		return failure
 
+	def __check_json(self, content):
 		if not isinstance(content, dict):
 			self.setResponseCode(400)
 			raise ValueError('The message payload must be a dict/json-object.')
@@ -331,28 +598,24 @@ class UMCRequest(Request):
 
 	def __parse_file_upload(self, params):
 		# TODO: implement patch from Bug #31923
+		if self.multipart is None:
+			self.setResponseCode(400)
+			raise ValueError('The multipart boundary is missing.')
+
 		if not self.path.startswith('/upload'):  # HTTP FIXME
+			self.multipart.remove()
 			self.setResponseCode(415)
 			raise ValueError('File uploads are currently only supported on /upload.')
 
-		ucr.load()
+		# the files were already written while the body was received
+		self.multipart.close()
 
-		fields = FieldStorage(
-			self.content,
-			headers={'content-type': self.getHeader('Content-Type')},
-			environ={'REQUEST_METHOD': 'POST'}
-		).list
-
-		body = dict((field.name, field.value) for field in fields if not field.filename)
+		body = dict((field.name, field.value) for field in self.multipart.fields)
 		body['options'] = []
 
-		for field in (field for field in fields if field.filename):
-			name, filename, value = field.name, field.filename, field.value
-			tmpfile = NamedTemporaryFile(dir=TEMPUPLOADDIR, delete=False)
-			tmpfile.write(value)
-
-			self.__check_max_file_size(tmpfile.name)
-			self.__check_min_free_space_on_partition(tmpfile.name)
+		for field in self.multipart.files:
+			name, filename, tmpfile = field.name, field.filename, field.tmpfile
+			upload_janitor.add(tmpfile.name, field.size, self.upload_session)
 
 			# some security
 			for c in ('<>/'):
@@ -366,8 +629,7 @@ class UMCRequest(Request):
 
 		return body
 
-	def __check_max_file_size(self, filename):
-		st_size = stat(filename).st_size
+	def __check_max_file_size(self, st_size):
 		if st_size > self.max_upload_size:
 			CORE.warn('File of size %d could not be uploaded' % (st_size))
 			self.setResponseCode(400)  # HTTP FIXME: 413 entity too large
@@ -398,11 +660,11 @@ class UMCRequest(Request):
 	def __add_sso_session(self):
 		session = self.getSession()
 		login_token = sha256(session.uid).hexdigest()
-		self.single_sign_on.sessions[login_token] = session
-		reactor.callLater(self.sso_timeout, self.__expire_sso_session, login_token)
+		self.site.session_store.add_token(login_token, session, self.sso_timeout)
 
-	def __expire_sso_session(self, login_token):
-		self.single_sign_on.sessions.pop(login_token, None)
+	def save_session(self):
+		"""Make the changed session available to the other server processes"""
+		self.site.session_store.save(self.getSession())
 
 	def notify_on_authenticated(self, callback):
 		self._authenticated_callbacks.append(callback)
@@ -427,6 +689,39 @@ class UMCRequest(Request):
 				self.args[name] = value[0]
 
 
+class ResponseProducer(object):
+	"""Writes the chunks of a response one after another when the client is ready to receive them"""
+	implements(IPullProducer)
+
+	def __init__(self, request, chunks):
+		self.request = request
+		self.chunks = iter(chunks)
+		self.current = iter(())
+
+	def start(self):
+		self.request.registerProducer(self, False)
+
+	def resumeProducing(self):
+		# the transport asks again only after something was written, so never return without writing
+		while True:
+			for data in self.current:
+				if data:
+					self.request.write(data)
+					return
+			chunk = next(self.chunks, None)
+			if chunk is None:
+				self.request.unregisterProducer()
+				self.request.finish()
+				return
+			self.current = iter((chunk,)) if isinstance(chunk, bytes) else iter(chunk)
+
+	def stopProducing(self):
+		if hasattr(self.current, 'close'):
+			self.current.close()
+		self.chunks = iter(())
+		self.current = iter(())
+
+
 def _replace_session_name():
 	# Replaces TWISTED_SESSION by UMCSessionId
 	func = Request.getSession.im_func
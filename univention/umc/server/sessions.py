@@ -0,0 +1,290 @@
+# -*- coding: utf-8 -*-
+#
+# Univention Management Console
+#
+# Copyright 2014 Univention GmbH
+#
+# http://www.univention.de/
+#
+# All rights reserved.
+#
+# The source code of this program is made available
+# under the terms of the GNU Affero General Public License version 3
+# (GNU AGPL V3) as published by the Free Software Foundation.
+#
+# Binary versions of this program provided by Univention to you as
+# well as other copyrighted, protected or trademarked materials like
+# Logos, graphics, fonts, specific documentations and configurations,
+# cryptographic keys etc. are subject to a license agreement between
+# you and Univention and not subject to the GNU AGPL V3.
+#
+# In the case you use this program under the terms of the GNU AGPL V3,
+# the program is provided in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public
+# License with the Debian GNU/Linux or Univention distribution in file
+# /usr/share/common-licenses/AGPL-3; if not, see
+# <http://www.gnu.org/licenses/>.
+
+import os
+import json
+import sqlite3
+from time import time
+
+from univention.umc import User, Translation
+from univention.umc.util import CORE, ucr, metrics
+from univention.umc.util.crypto import get_secret, encrypt, decrypt
+
+__all__ = ['MemorySessionBackend', 'SQLiteSessionBackend', 'SessionStore']
+
+SESSION_SECRET = '/etc/univention/umc-session.secret'
+SESSION_DATABASE = '/var/cache/univention-management-console/sessions.sqlite'
+SESSION_SNAPSHOT = '/var/cache/univention-management-console/sessions.snapshot'
+TOUCH_INTERVAL = 60
+# seconds a write waits for another process holding the database lock
+BUSY_TIMEOUT = 1
+
+
+class MemorySessionBackend(object):
+	"""Keeps sessions only in the memory of the process; a snapshot keeps them across restarts"""
+
+	persistent = False
+
+	def __init__(self):
+		self.tokens = {}
+
+	def load(self, uid):
+		return None
+
+	def save(self, uid, data, expires):
+		pass
+
+	def touch(self, uid, expires):
+		pass
+
+	def exists(self, uid):
+		return True
+
+	def delete(self, uid, before=None):
+		pass
+
+	def add_token(self, token, uid, expires):
+		self.purge()
+		self.tokens[token] = (uid, expires)
+
+	def pop_token(self, token):
+		uid, expires = self.tokens.pop(token, (None, 0))
+		if expires >= time():
+			return uid
+
+	def purge(self):
+		now = time()
+		for token, (uid, expires) in self.tokens.items():
+			if expires < now:
+				del self.tokens[token]
+
+
+class SQLiteSessionBackend(MemorySessionBackend):
+	"""Stores the encrypted sessions in a SQLite database in WAL mode which is shared by all server processes.
+
+	The queries run on the reactor thread. Each touches one row by its primary key; in WAL mode reads never
+	wait for writers, a write waits at most BUSY_TIMEOUT seconds for the lock. Writes happen on login,
+	logout, locale changes, Single Sign On and at most every TOUCH_INTERVAL seconds per session.
+	"""
+
+	persistent = True
+
+	def __init__(self, filename, secret):
+		self.secret = secret
+		self.db = sqlite3.connect(filename, timeout=BUSY_TIMEOUT, isolation_level=None)
+		self.db.execute('PRAGMA journal_mode=WAL')
+		self.db.execute('PRAGMA synchronous=NORMAL')
+		self.db.execute('CREATE TABLE IF NOT EXISTS sessions (uid TEXT PRIMARY KEY, data BLOB, expires REAL)')
+		self.db.execute('CREATE TABLE IF NOT EXISTS tokens (token TEXT PRIMARY KEY, uid TEXT, expires REAL)')
+
+	def load(self, uid):
+		row = self.db.execute('SELECT data FROM sessions WHERE uid = ? AND expires >= ?', (uid, time())).fetchone()
+		if row is None:
+			return
+		try:
+			return decrypt(self.secret, bytes(row[0]))
+		except ValueError as exc:
+			CORE.warn('Could not restore session: %s' % (exc,))
+
+	def save(self, uid, data, expires):
+		data = sqlite3.Binary(encrypt(self.secret, data))
+		self.db.execute('INSERT OR REPLACE INTO sessions (uid, data, expires) VALUES (?, ?, ?)', (uid, data, expires))
+
+	def touch(self, uid, expires):
+		self.db.execute('UPDATE sessions SET expires = ? WHERE uid = ?', (expires, uid))
+
+	def exists(self, uid):
+		return self.db.execute('SELECT 1 FROM sessions WHERE uid = ?', (uid,)).fetchone() is not None
+
+	def delete(self, uid, before=None):
+		"""Deletes the session; only if it was not used by another process since before if given"""
+		if before is None:
+			self.db.execute('DELETE FROM sessions WHERE uid = ?', (uid,))
+		else:
+			self.db.execute('DELETE FROM sessions WHERE uid = ? AND expires < ?', (uid, before))
+
+	def add_token(self, token, uid, expires):
+		self.purge()
+		self.db.execute('INSERT OR REPLACE INTO tokens (token, uid, expires) VALUES (?, ?, ?)', (token, uid, expires))
+
+	def pop_token(self, token):
+		self.db.execute('BEGIN IMMEDIATE')
+		try:
+			row = self.db.execute('SELECT uid FROM tokens WHERE token = ? AND expires >= ?', (token, time())).fetchone()
+			self.db.execute('DELETE FROM tokens WHERE token = ?', (token,))
+		finally:
+			self.db.execute('COMMIT')
+		if row is not None:
+			return row[0]
+
+	def purge(self):
+		now = time()
+		self.db.execute('DELETE FROM tokens WHERE expires < ?', (now,))
+		self.db.execute('DELETE FROM sessions WHERE expires < ?', (now,))
+
+
+class SessionStore(object):
+	"""Saves the authentication state of sessions so that every server process can restore them"""
+
+	@property
+	def backend_name(self):
+		return ucr.get('umc/server/session/backend', 'memory')
+
+	@property
+	def snapshot_ttl(self):
+		return int(ucr.get('umc/server/session/snapshot/ttl', 600))
+
+	def __init__(self, site):
+		self.site = site
+		self.touched = {}
+		self.backend = self.get_backend()
+
+	def get_backend(self):
+		if self.backend_name == 'sqlite':
+			filename = ucr.get('umc/server/session/database', SESSION_DATABASE)
+			try:
+				return SQLiteSessionBackend(filename, get_secret(SESSION_SECRET))
+			except (sqlite3.Error, EnvironmentError) as exc:
+				CORE.error('Could not open session database %s: %s' % (filename, exc))
+		return MemorySessionBackend()
+
+	def get_state(self, session):
+		return dict(
+			user=User(session).get_state(),
+			locale=Translation(session).get_language(),
+		)
+
+	def set_state(self, session, state):
+		User(session).set_state(state['user'])
+		Translation(session).set_language(state['locale'])
+
+	def save(self, session):
+		"""Saves the session after it changed, e.g. after authentication"""
+		if session.uid not in self.touched:
+			session.notifyOnExpire(lambda: self.expired(session))
+		self.touched[session.uid] = time()
+		self.backend.save(session.uid, json.dumps(self.get_state(session)), time() + session.sessionTimeout)
+
+	def touch(self, session):
+		"""Marks the session as used; it is written at most every TOUCH_INTERVAL seconds.
+		Returns False if the session was logged out in another server process."""
+		last = self.touched.get(session.uid)
+		if last is None:
+			return True
+		if not self.backend.exists(session.uid):
+			CORE.info('Session %s was logged out by another process' % (session.uid,))
+			self.touched.pop(session.uid, None)
+			return False
+		if last + TOUCH_INTERVAL < time():
+			self.touched[session.uid] = time()
+			self.backend.touch(session.uid, time() + session.sessionTimeout)
+		return True
+
+	def restore(self, uid):
+		"""Restores a session which was created by another server process or before a restart"""
+		data = self.backend.load(uid)
+		if data is None:
+			return
+		return self.restore_session(uid, json.loads(data))
+
+	def restore_session(self, uid, state):
+		session = self.site.sessionFactory(self.site, uid)
+		self.site.sessions[uid] = session
+		session.startCheckingExpiration()
+		self.set_state(session, state)
+		self.touched[uid] = time()
+		session.notifyOnExpire(lambda: self.expired(session))
+		metrics.counter('session.restored').increment()
+		CORE.info('Restored session %s' % (uid,))
+		return session
+
+	def snapshot(self):
+		"""Writes the authenticated sessions to disk when the server stops, unless the backend keeps them anyway"""
+		if self.backend.persistent:
+			return
+		now = time()
+		sessions = []
+		for uid, session in self.site.sessions.items():
+			if uid in self.touched:
+				sessions.append(dict(uid=uid, state=self.get_state(session), expires=session.lastModified + session.sessionTimeout))
+		if not sessions:
+			return
+
+		CORE.process('Saving %d sessions' % (len(sessions),))
+		data = encrypt(get_secret(SESSION_SECRET), json.dumps(dict(created=now, sessions=sessions)))
+		filename = '%s.tmp' % (SESSION_SNAPSHOT,)
+		try:
+			fd = os.open(filename, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0600)
+			with os.fdopen(fd, 'wb') as fd:
+				fd.write(data)
+			os.rename(filename, SESSION_SNAPSHOT)
+		except EnvironmentError as exc:
+			CORE.error('Could not save sessions: %s' % (exc,))
+
+	def restore_snapshot(self):
+		"""Restores the sessions saved when the server stopped; the snapshot is used only once"""
+		try:
+			with open(SESSION_SNAPSHOT, 'rb') as fd:
+				data = fd.read()
+			os.unlink(SESSION_SNAPSHOT)
+		except EnvironmentError:
+			return
+
+		try:
+			snapshot = json.loads(decrypt(get_secret(SESSION_SECRET), data))
+		except (ValueError, EnvironmentError) as exc:
+			CORE.warn('Could not restore sessions: %s' % (exc,))
+			return
+
+		now = time()
+		if snapshot['created'] + self.snapshot_ttl < now:
+			CORE.process('Ignoring outdated session snapshot')
+			return
+		sessions = [session for session in snapshot['sessions'] if session['expires'] >= now]
+		CORE.process('Restoring %d sessions' % (len(sessions),))
+		for session in sessions:
+			restored = self.restore_session(session['uid'], session['state'])
+			restored.lastModified = session['expires'] - restored.sessionTimeout
+
+	def expired(self, session):
+		# another process may still use the session; it is deleted only if it was not used since its timeout
+		self.touched.pop(session.uid, None)
+		self.backend.delete(session.uid, time())
+
+	def logout(self, session):
+		self.touched.pop(session.uid, None)
+		self.backend.delete(session.uid)
+
+	def add_token(self, token, session, timeout):
+		self.backend.add_token(token, session.uid, time() + timeout)
+
+	def pop_token(self, token):
+		return self.backend.pop_token(token)
@@ -32,32 +32,73 @@
 from signal import signal, SIGUSR1, SIGUSR2, SIGHUP
 
 from twisted.web.server import Site
+from twisted.internet import reactor
+from twisted.internet.threads import deferToThread
 
 from univention.umc.util import (
 	CORE, RESOURCES, set_log_level, ucr,
 	get_current_log_level, category, module
 )
 from univention.umc.server.request import UMCRequest
+from univention.umc.server.channel import UMCChannel
+from univention.umc.server.sessions import SessionStore
 from univention.umc.server.root import ServerRoot
 
 
+class Definitions(object):
+	"""The module and category definitions; never modified once loaded, a reload creates a new instance"""
+
+	__slots__ = ('modules', 'categories')
+
+	def __init__(self, modules, categories):
+		self.modules = modules
+		self.categories = categories
+
+	@classmethod
+	def load(cls):
+		modules = module.Manager()
+		modules.load()
+		categories = category.Manager()
+		categories.load()
+		return cls(modules, categories)
+
+
 class ServerSite(Site):
 
+	protocol = UMCChannel
+	reloading = False
+	reload_pending = False
+
+	@property
+	def moduleManager(self):
+		return self.definitions.modules
+
+	@property
+	def categoryManager(self):
+		return self.definitions.categories
+
+	@property
+	def max_pipelined_requests(self):
+		return max(1, int(ucr.get('umc/http/pipelining/max', 8)))
+
 	@property
 	def debug_level(self):
 		return int(ucr.get('umc/server/debug/level', 2))
 
 	def __init__(self, root, logPath=None, timeout=43200):
 		Site.__init__(self, root, logPath, timeout)
-		self.categoryManager = category.Manager()
-		self.moduleManager = module.Manager()
-		self.reload()
+		self.channels = set()
+		ucr.load()
+		self.definitions = Definitions.load()
 		self.add_signal_handler()
 
+	def notify_on_channel_closed(self):
+		pass
+
 	def add_signal_handler(self):
 		signal(SIGUSR1, lambda signo, stack: self.increase_log_level(1))
 		signal(SIGUSR2, lambda signo, stack: self.increase_log_level(-1))
-		signal(SIGHUP, lambda signo, stack: self.reload(True))
+		signal(SIGHUP, lambda signo, stack: reactor.callFromThread(self.reload, True))
 
 	def increase_log_level(self, delta=1):
 		level = get_current_log_level()
@@ -73,17 +114,39 @@ class ServerSite(Site):
 
 	def reload(self, reset_log_level=False):
 		"""Reloads resources like module and category definitions"""
-		RESOURCES.info('Reloading resources: modules, categories')
-		self.moduleManager.load()
-		self.categoryManager.load()
 		RESOURCES.info('Reloading UCR variables')
 		ucr.load()
 		if reset_log_level:
 			RESOURCES.info('Reset log level.')
 			self.reset_log_level()
+		self.reload_definitions()
 		# TODO: may reload_ldap_connections()  (not necessary due to ReloadingLDAPConnection)
 		# TODO: maybe it would be nice to have something like notify_on_reload
 
+	def reload_definitions(self):
+		"""Parses the definitions in a thread; requests keep using the current ones until they are replaced"""
+		if self.reloading:
+			self.reload_pending = True
+			return
+		RESOURCES.info('Reloading resources: modules, categories')
+		self.reloading = True
+		loaded = deferToThread(Definitions.load)
+		loaded.addCallbacks(self._definitions_loaded, self._reload_failed)
+		loaded.addBoth(self._reload_done)
+
+	def _definitions_loaded(self, definitions):
+		self.definitions = definitions
+		RESOURCES.info('Reloaded %d modules and %d categories' % (len(definitions.modules), len(definitions.categories)))
+
+	def _reload_failed(self, failure):
+		RESOURCES.error('Reloading the module and category definitions failed; keeping the current ones: %s' % (failure.getTraceback(),))
+
+	def _reload_done(self, result):
+		self.reloading = False
+		if self.reload_pending:
+			self.reload_pending = False
+			self.reload_definitions()
+
 
 class Server(ServerSite):
 
@@ -94,6 +157,20 @@ class Server(ServerSite):
 	def __init__(self):
 		ServerSite.__init__(self, ServerRoot(), timeout=self.timeout)
 		self.register_factories()
+		self.session_store = SessionStore(self)
+
+	def getSession(self, uid):
+		"""Returns the session; restores it from the session store if it is unknown to this process"""
+		try:
+			session = ServerSite.getSession(self, uid)
+		except KeyError:
+			session = self.session_store.restore(uid)
+			if session is None:
+				raise
+		if not self.session_store.touch(session):
+			session.expire()
+			raise KeyError(uid)
+		return session
 
 	def register_factories(self):
 		self.requestFactory = UMCRequest
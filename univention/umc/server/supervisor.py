@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+#
+# Univention Management Console
+#
+# Copyright 2014 Univention GmbH
+#
+# http://www.univention.de/
+#
+# All rights reserved.
+#
+# The source code of this program is made available
+# under the terms of the GNU Affero General Public License version 3
+# (GNU AGPL V3) as published by the Free Software Foundation.
+#
+# Binary versions of this program provided by Univention to you as
+# well as other copyrighted, protected or trademarked materials like
+# Logos, graphics, fonts, specific documentations and configurations,
+# cryptographic keys etc. are subject to a license agreement between
+# you and Univention and not subject to the GNU AGPL V3.
+#
+# In the case you use this program under the terms of the GNU AGPL V3,
+# the program is provided in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public
+# License with the Debian GNU/Linux or Univention distribution in file
+# /usr/share/common-licenses/AGPL-3; if not, see
+# <http://www.gnu.org/licenses/>.
+
+import os
+import socket
+from signal import signal, SIGTERM, SIGKILL, SIGHUP, SIGUSR1, SIGUSR2
+from time import time
+
+from twisted.internet import reactor
+from twisted.internet.defer import Deferred, DeferredList
+from twisted.internet.protocol import ProcessProtocol
+
+from univention.umc.util import CORE
+from univention.umc.server.upgrade import UPGRADE_SIGNAL, FIRST_LISTEN_FD
+
+__all__ = ['WorkerSupervisor', 'bind_tcp', 'bind_unix']
+
+RESTART_DELAY = 1
+MAX_RESTART_DELAY = 30
+STABLE_UPTIME = 10
+STOP_TIMEOUT = 10
+
+
+def bind_tcp(interface, port):
+	"""Creates a listening TCP socket which is passed to the workers"""
+	family = socket.AF_INET6 if ':' in interface else socket.AF_INET
+	sock = socket.socket(family, socket.SOCK_STREAM)
+	sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+	sock.bind((interface, port))
+	sock.listen(socket.SOMAXCONN)
+	sock.setblocking(False)
+	return sock
+
+
+def bind_unix(path, mode=0666):
+	"""Creates a listening UNIX socket which is passed to the workers"""
+	if os.path.exists(path):
+		os.unlink(path)
+	sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+	sock.bind(path)
+	os.chmod(path, mode)
+	sock.listen(socket.SOMAXCONN)
+	sock.setblocking(False)
+	return sock
+
+
+class Worker(ProcessProtocol):
+
+	def __init__(self, supervisor, number):
+		self.supervisor = supervisor
+		self.number = number
+		self.started = time()
+		self.ended = Deferred()
+		self.pid = None
+
+	def connectionMade(self):
+		self.pid = self.transport.pid
+		CORE.process('Started umc-server worker %d (%d)' % (self.number, self.pid))
+
+	def processEnded(self, reason):
+		CORE.process('umc-server worker %d (%s) exited: %s' % (self.number, self.pid, reason.getErrorMessage()))
+		self.pid = None
+		self.ended.callback(None)
+		self.supervisor.worker_ended(self)
+
+	def signal(self, signo):
+		if self.pid is None:
+			return
+		try:
+			os.kill(self.pid, signo)
+		except OSError:
+			pass
+
+
+class WorkerSupervisor(object):
+	"""Starts the umc-server workers which serve the inherited listening sockets; restarts crashed workers"""
+
+	def __init__(self, command, args, sockets, count):
+		self.command = command
+		self.args = args
+		self.sockets = sockets
+		self.count = count
+		self.workers = {}
+		self.delays = {}
+		self.stopping = False
+
+	@property
+	def listen_fds(self):
+		return range(FIRST_LISTEN_FD, FIRST_LISTEN_FD + len(self.sockets))
+
+	def start(self):
+		for number in range(self.count):
+			self.spawn(number)
+		for signo in (SIGHUP, SIGUSR1, SIGUSR2):
+			signal(signo, self.forward_signal)
+
+	def spawn(self, number):
+		if self.stopping:
+			return
+		fds = {0: 0, 1: 1, 2: 2}
+		for fd, sock in zip(self.listen_fds, self.sockets):
+			fds[fd] = sock.fileno()
+		args = [self.command] + self.args + ['--listen-fds', ','.join(map(str, self.listen_fds))]
+		worker = Worker(self, number)
+		self.workers[number] = worker
+		reactor.spawnProcess(worker, self.command, args, env=os.environ, childFDs=fds)
+
+	def worker_ended(self, worker):
+		if self.workers.get(worker.number) is worker:
+			del self.workers[worker.number]
+		if self.stopping:
+			return
+
+		# back off if the worker crashes right after it started
+		delay = RESTART_DELAY
+		if time() - worker.started < STABLE_UPTIME:
+			delay = min(MAX_RESTART_DELAY, self.delays.get(worker.number, RESTART_DELAY) * 2)
+		self.delays[worker.number] = delay
+		CORE.warn('Restarting umc-server worker %d in %d seconds' % (worker.number, delay))
+		reactor.callLater(delay, self.spawn, worker.number)
+
+	def forward_signal(self, signo, frame):
+		for worker in self.workers.values():
+			worker.signal(signo)
+
+	def drain(self):
+		"""Lets the workers answer their pending requests and exit; fires when they have exited"""
+		self.stopping = True
+		workers = self.workers.values()
+		for worker in workers:
+			worker.signal(UPGRADE_SIGNAL)
+		return DeferredList([worker.ended for worker in workers])
+
+	def stop(self):
+		self.stopping = True
+		workers = self.workers.values()
+		for worker in workers:
+			worker.signal(SIGTERM)
+		kill = reactor.callLater(STOP_TIMEOUT, self.kill)
+		stopped = DeferredList([worker.ended for worker in workers])
+		stopped.addCallback(lambda result: kill.active() and kill.cancel())
+		return stopped
+
+	def kill(self):
+		for worker in self.workers.values():
+			CORE.warn('Killing umc-server worker %d (%s)' % (worker.number, worker.pid))
+			worker.signal(SIGKILL)
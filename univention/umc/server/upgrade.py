@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+#
+# Univention Management Console
+#
+# Copyright 2014 Univention GmbH
+#
+# http://www.univention.de/
+#
+# All rights reserved.
+#
+# The source code of this program is made available
+# under the terms of the GNU Affero General Public License version 3
+# (GNU AGPL V3) as published by the Free Software Foundation.
+#
+# Binary versions of this program provided by Univention to you as
+# well as other copyrighted, protected or trademarked materials like
+# Logos, graphics, fonts, specific documentations and configurations,
+# cryptographic keys etc. are subject to a license agreement between
+# you and Univention and not subject to the GNU AGPL V3.
+#
+# In the case you use this program under the terms of the GNU AGPL V3,
+# the program is provided in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public
+# License with the Debian GNU/Linux or Univention distribution in file
+# /usr/share/common-licenses/AGPL-3; if not, see
+# <http://www.gnu.org/licenses/>.
+
+import os
+from signal import SIGQUIT
+
+from twisted.internet import reactor, tcp, unix
+from twisted.internet.defer import Deferred
+from twisted.internet.protocol import ProcessProtocol
+
+from univention.umc.util import CORE
+
+__all__ = ['UPGRADE_SIGNAL', 'PIDFILE', 'NewServer', 'write_pidfile', 'read_pidfile', 'remove_pidfile', 'UNIXPort', 'stop_listening', 'drain']
+
+UPGRADE_SIGNAL = SIGQUIT
+PIDFILE = '/var/run/umc-server.pid'
+FIRST_LISTEN_FD = 3
+
+
+def write_pidfile(filename=PIDFILE):
+	tmpfile = '%s.tmp' % (filename,)
+	try:
+		with open(tmpfile, 'wb') as fd:
+			fd.write('%d\n' % (os.getpid(),))
+		os.rename(tmpfile, filename)
+	except EnvironmentError as exc:
+		CORE.warn('Could not write pidfile: %s' % (exc,))
+
+
+def read_pidfile(filename=PIDFILE):
+	try:
+		with open(filename, 'rb') as fd:
+			return int(fd.read().strip())
+	except (EnvironmentError, ValueError):
+		return
+
+
+def remove_pidfile(filename=PIDFILE):
+	# after an upgrade the pidfile belongs to the new server
+	if read_pidfile(filename) == os.getpid():
+		os.unlink(filename)
+
+
+class NewServer(ProcessProtocol):
+	"""A freshly executed umc-server which takes over the listening sockets"""
+
+	def __init__(self, sockets):
+		self.sockets = sockets
+		self.ready = Deferred()
+		self.pid = None
+
+	@property
+	def listen_fds(self):
+		return range(FIRST_LISTEN_FD, FIRST_LISTEN_FD + len(self.sockets))
+
+	@property
+	def ready_fd(self):
+		return FIRST_LISTEN_FD + len(self.sockets)
+
+	def spawn(self, command, args):
+		fds = {0: 0, 1: 1, 2: 2, self.ready_fd: 'r'}
+		for fd, sock in zip(self.listen_fds, self.sockets):
+			fds[fd] = sock.fileno()
+		args = [command] + args + ['--listen-fds', ','.join(map(str, self.listen_fds)), '--ready-fd', str(self.ready_fd)]
+		reactor.spawnProcess(self, command, args, env=os.environ, childFDs=fds)
+		return self.ready
+
+	def connectionMade(self):
+		self.pid = self.transport.pid
+
+	def childDataReceived(self, fd, data):
+		if fd == self.ready_fd and not self.ready.called:
+			CORE.process('New umc-server (%d) is ready' % (self.pid,))
+			self.ready.callback(self.pid)
+
+	def processEnded(self, reason):
+		if not self.ready.called:
+			self.ready.errback(reason)
+
+
+class UNIXPort(unix.Port):
+	"""A UNIX port which can stop listening without removing its socket file"""
+
+	unlink = True
+
+	def connectionLost(self, reason):
+		if self.unlink:
+			return unix.Port.connectionLost(self, reason)
+		return tcp.Port.connectionLost(self, reason)
+
+
+def stop_listening(port):
+	"""Stops accepting connections on a port which the new server listens on now"""
+	if isinstance(port, UNIXPort):
+		# the new server is still serving the socket file
+		port.unlink = False
+	port.stopListening()
+
+
+def drain(site, timeout):
+	"""Closes idle connections and the others once their requests are answered; fires when all are closed"""
+	drained = Deferred()
+
+	def check():
+		if site.channels:
+			return
+		if timer.active():
+			timer.cancel()
+		if not drained.called:
+			drained.callback(None)
+
+	def timed_out():
+		CORE.warn('Closing %d connections with unfinished requests' % (len(site.channels),))
+		for channel in list(site.channels):
+			channel.transport.loseConnection()
+		if not drained.called:
+			drained.callback(None)
+
+	CORE.process('Draining %d connections' % (len(site.channels),))
+	timer = reactor.callLater(timeout, timed_out)
+	site.notify_on_channel_closed = check
+	for channel in list(site.channels):
+		channel.drain()
+	check()
+	return drained
@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+#
+# Univention Management Console
+#
+# Copyright 2014 Univention GmbH
+#
+# http://www.univention.de/
+#
+# All rights reserved.
+#
+# The source code of this program is made available
+# under the terms of the GNU Affero General Public License version 3
+# (GNU AGPL V3) as published by the Free Software Foundation.
+#
+# Binary versions of this program provided by Univention to you as
+# well as other copyrighted, protected or trademarked materials like
+# Logos, graphics, fonts, specific documentations and configurations,
+# cryptographic keys etc. are subject to a license agreement between
+# you and Univention and not subject to the GNU AGPL V3.
+#
+# In the case you use this program under the terms of the GNU AGPL V3,
+# the program is provided in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public
+# License with the Debian GNU/Linux or Univention distribution in file
+# /usr/share/common-licenses/AGPL-3; if not, see
+# <http://www.gnu.org/licenses/>.
+
+from os import listdir, lstat, unlink
+from os.path import join, basename
+from stat import S_ISREG
+from time import time
+
+from twisted.internet.task import LoopingCall
+
+from univention.umc.util import CORE, ucr, metrics
+
+__all__ = ['TEMPUPLOADDIR', 'UploadJanitor', 'upload_janitor']
+
+TEMPUPLOADDIR = '/var/tmp/univention-management-console-frontend'
+CLEAN_INTERVAL = 60
+
+
+class UploadJanitor(object):
+	"""Removes uploaded files of expired sessions, old ones and those exceeding the quota of the upload directory"""
+
+	@property
+	def ttl(self):
+		return int(ucr.get('umc/server/upload/ttl', 86400))
+
+	@property
+	def quota(self):
+		return int(ucr.get('umc/server/upload/quota', 1048576)) * 1024  # kilobyte
+
+	def __init__(self, directory):
+		self.directory = directory
+		self.sessions = {}
+		self.files = 0
+		self.usage = 0
+		self._janitor = LoopingCall(self.clean)
+		metrics.gauge('upload.files', lambda: self.files)
+		metrics.gauge('upload.bytes', lambda: self.usage)
+
+	def start(self):
+		self._janitor.start(CLEAN_INTERVAL, now=True)
+
+	def stop(self):
+		if self._janitor.running:
+			self._janitor.stop()
+
+	def add(self, filename, size, session=None):
+		"""Removes the uploaded file when the session expires"""
+		self.files += 1
+		self.usage += size
+		if session is None:
+			return
+		if session.uid not in self.sessions:
+			self.sessions[session.uid] = set()
+			session.notifyOnExpire(lambda: self.on_session_expired(session.uid))
+		self.sessions[session.uid].add(filename)
+
+	def resolve(self, handle, session):
+		"""Returns the path of the file uploaded in the session which the handle names or None"""
+		if not isinstance(handle, basestring):
+			return
+		filename = join(self.directory, basename(handle))
+		if filename in self.sessions.get(session.uid, ()):
+			return filename
+
+	def on_session_expired(self, uid):
+		for filename in self.sessions.pop(uid, ()):
+			self.remove(filename)
+
+	def exceeds_quota(self, size):
+		return self.quota and self.usage + size > self.quota
+
+	def remove(self, filename):
+		try:
+			unlink(filename)
+		except OSError:
+			return
+		metrics.counter('upload.removed').increment()
+
+	def clean(self):
+		"""Removes files older than the TTL and the oldest files while the quota is exceeded"""
+		try:
+			filenames = listdir(self.directory)
+		except OSError as exc:
+			CORE.warn('Could not read upload directory: %s' % (exc,))
+			return
+
+		files = []
+		for filename in filenames:
+			filename = join(self.directory, filename)
+			try:
+				st = lstat(filename)
+			except OSError:
+				continue
+			if S_ISREG(st.st_mode):
+				files.append((st.st_mtime, st.st_size, filename))
+
+		files.sort()
+		expired = time() - self.ttl
+		while files and self.ttl and files[0][0] < expired:
+			self.remove(files.pop(0)[2])
+
+		usage = sum(size for mtime, size, filename in files)
+		while files and self.quota and usage > self.quota:
+			mtime, size, filename = files.pop(0)
+			CORE.warn('Upload quota exceeded; removing %s' % (filename,))
+			self.remove(filename)
+			usage -= size
+
+		self.files = len(files)
+		self.usage = usage
+
+
+upload_janitor = UploadJanitor(TEMPUPLOADDIR)
@@ -36,7 +36,9 @@ from functools import wraps
 from univention.umc.util import module, category
 from univention.umc.util.config import ucr
 from univention.umc.util.locales import set_locale, Translation, change_locale
+from univention.umc.util.metrics import metrics
 from univention.umc.util.process import UMCModuleProcess
+from univention.umc.util.registry import module_processes
 from univention.umc.util.udm import get_userdn_by_username, get_user_object, get_machine_connection
 from univention.umc.util.status import (
 	status_description, BAD_REQUEST_UNAUTH,
@@ -53,7 +55,8 @@ from univention.umc.util.log import (
 __all__ = (
 	'get_userdn_by_username', 'get_user_object', 'get_machine_connection',
 	'status_description', 'BAD_REQUEST_UNAUTH', 'MODULE_ERR_COMMAND_FAILED', 'MODULE_ERR',
-	'SUCCESS', 'ucr', 'AUTH', 'CORE', 'MODULE', 'set_locale', 'UMCModuleProcess'
+	'SUCCESS', 'ucr', 'AUTH', 'CORE', 'MODULE', 'set_locale', 'UMCModuleProcess',
+	'metrics', 'module_processes'
 )
 UMC_CHANGELOG_FILE = '/usr/share/doc/univention-management-console-server/changelog.Debian.gz'
 
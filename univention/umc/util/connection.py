@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+#
+# Univention Management Console
+#
+# Copyright 2014 Univention GmbH
+#
+# http://www.univention.de/
+#
+# All rights reserved.
+#
+# The source code of this program is made available
+# under the terms of the GNU Affero General Public License version 3
+# (GNU AGPL V3) as published by the Free Software Foundation.
+#
+# Binary versions of this program provided by Univention to you as
+# well as other copyrighted, protected or trademarked materials like
+# Logos, graphics, fonts, specific documentations and configurations,
+# cryptographic keys etc. are subject to a license agreement between
+# you and Univention and not subject to the GNU AGPL V3.
+#
+# In the case you use this program under the terms of the GNU AGPL V3,
+# the program is provided in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public
+# License with the Debian GNU/Linux or Univention distribution in file
+# /usr/share/common-licenses/AGPL-3; if not, see
+# <http://www.gnu.org/licenses/>.
+
+from twisted.web.client import HTTPConnectionPool, RequestNotSent, RequestTransmissionFailed, ResponseNeverReceived
+
+from univention.umc.util.log import MODULE
+from univention.umc.util.config import ucr
+from univention.umc.util.metrics import metrics
+
+__all__ = ['ModuleConnectionPool']
+
+
+class ModuleConnectionPool(HTTPConnectionPool):
+	"""Keeps persistent HTTP connections to a single module process"""
+
+	@property
+	def persistent_connections(self):
+		return ucr.is_true('umc/module/connection/persistent', True)
+
+	@property
+	def max_idle_connections(self):
+		return max(1, int(ucr.get('umc/module/connection/max_idle', 2)))
+
+	@property
+	def idle_timeout(self):
+		# the module process closes idle connections after umc/module/timeout
+		# seconds; close them earlier on our side to never reuse a closing connection
+		module_timeout = max(15, int(ucr.get('umc/module/timeout', 300) or 300))
+		return min(int(ucr.get('umc/module/connection/timeout', 240)), module_timeout - 10)
+
+	def __init__(self, reactor):
+		HTTPConnectionPool.__init__(self, reactor, persistent=self.persistent_connections)
+		self.maxPersistentPerHost = self.max_idle_connections
+		self.cachedConnectionTimeout = self.idle_timeout
+		self.hits = 0
+		self.misses = 0
+
+	def getConnection(self, key, endpoint):
+		if self._connections.get(key):
+			self.hits += 1
+			metrics.counter('module.connection.hits').increment()
+		else:
+			self.misses += 1
+			metrics.counter('module.connection.misses').increment()
+		return HTTPConnectionPool.getConnection(self, key, endpoint)
+
+	def request_failed(self, failure):
+		"""Drops the cached connections when a request failed on a connection the module process may have closed"""
+		if failure.check(RequestNotSent, RequestTransmissionFailed, ResponseNeverReceived):
+			MODULE.info('Dropping cached connections to module process: %s' % (failure.getErrorMessage(),))
+			self.closeCachedConnections()
+
+	def json(self):
+		return dict(
+			hits=self.hits,
+			misses=self.misses,
+			idle=sum(len(connections) for connections in self._connections.itervalues())
+		)
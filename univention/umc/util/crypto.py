@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+#
+# Univention Management Console
+#
+# Copyright 2014 Univention GmbH
+#
+# http://www.univention.de/
+#
+# All rights reserved.
+#
+# The source code of this program is made available
+# under the terms of the GNU Affero General Public License version 3
+# (GNU AGPL V3) as published by the Free Software Foundation.
+#
+# Binary versions of this program provided by Univention to you as
+# well as other copyrighted, protected or trademarked materials like
+# Logos, graphics, fonts, specific documentations and configurations,
+# cryptographic keys etc. are subject to a license agreement between
+# you and Univention and not subject to the GNU AGPL V3.
+#
+# In the case you use this program under the terms of the GNU AGPL V3,
+# the program is provided in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public
+# License with the Debian GNU/Linux or Univention distribution in file
+# /usr/share/common-licenses/AGPL-3; if not, see
+# <http://www.gnu.org/licenses/>.
+
+import os
+import hmac
+import errno
+from binascii import hexlify
+from hashlib import sha256
+
+from Crypto.Cipher import AES
+from Crypto.Util import Counter
+
+__all__ = ['get_secret', 'encrypt', 'decrypt']
+
+NONCE_SIZE = 16
+TAG_SIZE = 32
+
+
+def get_secret(filename, size=32):
+	"""Returns the secret stored in filename; creates it on first use"""
+	try:
+		fd = os.open(filename, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0600)
+	except OSError as exc:
+		if exc.errno != errno.EEXIST:
+			raise
+	else:
+		with os.fdopen(fd, 'wb') as fd:
+			fd.write(os.urandom(size))
+	with open(filename, 'rb') as fd:
+		return fd.read()
+
+
+def _derive(key, purpose):
+	return hmac.new(key, purpose, sha256).digest()
+
+
+def _cipher(key, nonce):
+	counter = Counter.new(128, initial_value=long(hexlify(nonce), 16))
+	return AES.new(_derive(key, 'encryption'), AES.MODE_CTR, counter=counter)
+
+
+def _equal(a, b):
+	# constant time comparison; hmac.compare_digest() requires Python 2.7.7
+	if len(a) != len(b):
+		return False
+	result = 0
+	for x, y in zip(a, b):
+		result |= ord(x) ^ ord(y)
+	return result == 0
+
+
+def encrypt(key, data):
+	"""Encrypts and authenticates data: AES-256 in counter mode, then HMAC-SHA256 over nonce and ciphertext"""
+	nonce = os.urandom(NONCE_SIZE)
+	ciphertext = _cipher(key, nonce).encrypt(data)
+	tag = hmac.new(_derive(key, 'authentication'), nonce + ciphertext, sha256).digest()
+	return nonce + ciphertext + tag
+
+
+def decrypt(key, data):
+	"""Returns the plaintext of encrypt(); raises ValueError if the data was modified or the key is wrong"""
+	if len(data) < NONCE_SIZE + TAG_SIZE:
+		raise ValueError('The encrypted data is truncated.')
+	nonce, ciphertext, tag = data[:NONCE_SIZE], data[NONCE_SIZE:-TAG_SIZE], data[-TAG_SIZE:]
+	if not _equal(tag, hmac.new(_derive(key, 'authentication'), nonce + ciphertext, sha256).digest()):
+		raise ValueError('The encrypted data is not authentic.')
+	return _cipher(key, nonce).decrypt(ciphertext)
@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -*-
+#
+# Univention Management Console
+#
+# Copyright 2014 Univention GmbH
+#
+# http://www.univention.de/
+#
+# All rights reserved.
+#
+# The source code of this program is made available
+# under the terms of the GNU Affero General Public License version 3
+# (GNU AGPL V3) as published by the Free Software Foundation.
+#
+# Binary versions of this program provided by Univention to you as
+# well as other copyrighted, protected or trademarked materials like
+# Logos, graphics, fonts, specific documentations and configurations,
+# cryptographic keys etc. are subject to a license agreement between
+# you and Univention and not subject to the GNU AGPL V3.
+#
+# In the case you use this program under the terms of the GNU AGPL V3,
+# the program is provided in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public
+# License with the Debian GNU/Linux or Univention distribution in file
+# /usr/share/common-licenses/AGPL-3; if not, see
+# <http://www.gnu.org/licenses/>.
+
+import marshal
+
+from twisted.internet.defer import Deferred, succeed
+from twisted.internet.protocol import Factory
+from twisted.protocols.basic import Int32StringReceiver
+from twisted.python.failure import Failure
+from twisted.web.client import ResponseDone
+from twisted.web.http_headers import Headers
+
+from univention.umc.util.log import MODULE
+from univention.umc.util.metrics import metrics
+
+__all__ = ['MAGIC', 'SESSION_HEADERS', 'FramedProtocol', 'FramedConnection', 'FramedResponse']
+
+# sent first by the client: lets the module process distinguish the framed protocol from HTTP
+MAGIC = b'UMCF\x01'
+
+# these headers are the same for every request of a session, they are sent once per connection
+SESSION_HEADERS = ('authorization', 'x-user-dn', 'x-umc-acls-version')
+
+
+class FramedProtocol(Int32StringReceiver):
+	"""Length prefixed frames, each a marshalled tuple of (frame type, ...)"""
+
+	MAX_LENGTH = 0x7fffffff
+
+	def sendFrame(self, *frame):
+		self.sendString(marshal.dumps(frame, 2))
+
+	def stringReceived(self, string):
+		try:
+			frame = marshal.loads(string)
+		except (ValueError, EOFError, TypeError) as exc:
+			MODULE.error('Invalid frame received: %s' % (exc,))
+			self.transport.loseConnection()
+			return
+		handler = getattr(self, 'frame_%s' % (frame[0],), None)
+		if handler is None:
+			MODULE.error('Unknown frame type received: %r' % (frame[0],))
+			self.transport.loseConnection()
+			return
+		handler(*frame[1:])
+
+	def lengthLimitExceeded(self, length):
+		MODULE.error('Frame of %d bytes exceeds the maximum size' % (length,))
+		self.transport.loseConnection()
+
+
+class ResponseBodyTransport(object):
+	"""The body of a framed response is complete already, so there is nothing to pause"""
+
+	def pauseProducing(self):
+		pass
+
+	def resumeProducing(self):
+		pass
+
+	def stopProducing(self):
+		pass
+
+
+class FramedResponse(object):
+	"""Provides the part of the twisted.web.client.Response interface which the Command resource uses"""
+
+	def __init__(self, code, headers, body):
+		self.code = code
+		self.headers = Headers(dict((name, [value]) for name, value in headers.iteritems()))
+		self.body = body
+
+	def deliverBody(self, protocol):
+		protocol.makeConnection(ResponseBodyTransport())
+		if self.body:
+			protocol.dataReceived(self.body)
+		protocol.connectionLost(Failure(ResponseDone()))
+
+
+class FramedModuleClient(FramedProtocol):
+	"""Multiplexes the requests to one module process over one connection"""
+
+	def __init__(self):
+		self.pending = {}
+		self.session_headers = None
+		self.next_id = 0
+
+	def connectionMade(self):
+		self.transport.write(MAGIC)
+
+	def request(self, path, headers, body):
+		headers = dict((name.lower(), value) for name, value in headers.iteritems())
+		session_headers = dict((name, headers.pop(name, '')) for name in SESSION_HEADERS)
+		if session_headers != self.session_headers:
+			self.session_headers = session_headers
+			self.sendFrame('session', session_headers)
+		else:
+			metrics.counter('module.framed.session_reused').increment()
+
+		self.next_id += 1
+		response = self.pending[self.next_id] = Deferred()
+		self.sendFrame('request', self.next_id, path, headers, body)
+		return response
+
+	def frame_response(self, request_id, code, headers, body):
+		response = self.pending.pop(request_id, None)
+		if response is None:
+			MODULE.warn('Response to unknown request %r received' % (request_id,))
+			return
+		response.callback(FramedResponse(code, headers, body))
+
+	def connectionLost(self, reason):
+		self.connected = 0
+		pending, self.pending = self.pending, {}
+		for response in pending.itervalues():
+			response.errback(reason)
+
+
+class FramedModuleClientFactory(Factory):
+
+	protocol = FramedModuleClient
+
+
+class FramedConnection(object):
+	"""Holds the framed connection to a module process and reconnects when it was lost"""
+
+	def __init__(self, endpoint):
+		self.endpoint = endpoint
+		self.client = None
+		self.waiting = []
+		self.answered = False
+
+	def connect(self):
+		if self.client is not None and self.client.connected:
+			return succeed(self.client)
+		waiting = Deferred()
+		self.waiting.append(waiting)
+		if len(self.waiting) == 1:
+			connecting = self.endpoint.connect(FramedModuleClientFactory())
+			connecting.addBoth(self._connected)
+		return waiting
+
+	def _connected(self, result):
+		if not isinstance(result, Failure):
+			self.client = result
+		waiting, self.waiting = self.waiting, []
+		for deferred in waiting:
+			if isinstance(result, Failure):
+				deferred.errback(result)
+			else:
+				deferred.callback(result)
+
+	def request(self, method, uri, headers, body):
+		body = body.read() if body is not None else ''
+		connection = self.connect()
+		connection.addCallback(lambda client: client.request(uri, headers or {}, body))
+		connection.addCallback(self._answered)
+		return connection
+
+	def _answered(self, response):
+		self.answered = True
+		return response
+
+	def close(self):
+		if self.client is not None and self.client.connected:
+			self.client.transport.loseConnection()
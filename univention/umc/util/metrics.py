@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+#
+# Univention Management Console
+#
+# Copyright 2014 Univention GmbH
+#
+# http://www.univention.de/
+#
+# All rights reserved.
+#
+# The source code of this program is made available
+# under the terms of the GNU Affero General Public License version 3
+# (GNU AGPL V3) as published by the Free Software Foundation.
+#
+# Binary versions of this program provided by Univention to you as
+# well as other copyrighted, protected or trademarked materials like
+# Logos, graphics, fonts, specific documentations and configurations,
+# cryptographic keys etc. are subject to a license agreement between
+# you and Univention and not subject to the GNU AGPL V3.
+#
+# In the case you use this program under the terms of the GNU AGPL V3,
+# the program is provided in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public
+# License with the Debian GNU/Linux or Univention distribution in file
+# /usr/share/common-licenses/AGPL-3; if not, see
+# <http://www.gnu.org/licenses/>.
+
+from bisect import bisect_left
+
+__all__ = ['Counter', 'Gauge', 'Histogram', 'MetricsRegistry', 'metrics']
+
+
+class Counter(object):
+
+	def __init__(self):
+		self.value = 0
+
+	def increment(self, value=1):
+		self.value += value
+
+	def json(self):
+		return self.value
+
+
+class Gauge(object):
+	"""A value which is computed when the metrics are read"""
+
+	def __init__(self, func):
+		self.func = func
+
+	def json(self):
+		return self.func()
+
+
+class Histogram(object):
+
+	buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+	def __init__(self, buckets=None):
+		if buckets is not None:
+			self.buckets = tuple(sorted(buckets))
+		self.counts = [0] * (len(self.buckets) + 1)
+		self.count = 0
+		self.sum = 0
+
+	def observe(self, value):
+		self.counts[bisect_left(self.buckets, value)] += 1
+		self.count += 1
+		self.sum += value
+
+	def json(self):
+		buckets = []
+		cumulative = 0
+		for bucket, count in zip(self.buckets + ('+Inf',), self.counts):
+			cumulative += count
+			buckets.append([bucket, cumulative])
+		return dict(count=self.count, sum=self.sum, buckets=buckets)
+
+
+class MetricsRegistry(object):
+	"""Collects the instrumentation of the running process"""
+
+	def __init__(self):
+		self.__metrics = {}
+
+	def counter(self, name):
+		return self.__metrics.setdefault(name, Counter())
+
+	def gauge(self, name, func):
+		self.__metrics[name] = Gauge(func)
+		return self.__metrics[name]
+
+	def histogram(self, name, buckets=None):
+		return self.__metrics.setdefault(name, Histogram(buckets))
+
+	def json(self):
+		return dict((name, metric.json()) for name, metric in self.__metrics.iteritems())
+
+metrics = MetricsRegistry()
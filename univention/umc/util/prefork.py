@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+#
+# Univention Management Console
+#
+# Copyright 2014 Univention GmbH
+#
+# http://www.univention.de/
+#
+# All rights reserved.
+#
+# The source code of this program is made available
+# under the terms of the GNU Affero General Public License version 3
+# (GNU AGPL V3) as published by the Free Software Foundation.
+#
+# Binary versions of this program provided by Univention to you as
+# well as other copyrighted, protected or trademarked materials like
+# Logos, graphics, fonts, specific documentations and configurations,
+# cryptographic keys etc. are subject to a license agreement between
+# you and Univention and not subject to the GNU AGPL V3.
+#
+# In the case you use this program under the terms of the GNU AGPL V3,
+# the program is provided in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public
+# License with the Debian GNU/Linux or Univention distribution in file
+# /usr/share/common-licenses/AGPL-3; if not, see
+# <http://www.gnu.org/licenses/>.
+
+from time import time
+
+from twisted.internet import reactor
+from twisted.internet.task import LoopingCall
+
+from univention.umc.util.log import MODULE
+from univention.umc.util.config import ucr
+from univention.umc.util.metrics import metrics
+from univention.umc.util.spawn import ModuleProcessProtocol, READY_FD
+
+__all__ = ['PreforkPool']
+
+
+class PreforkPool(object):
+	"""Keeps started module processes which wait for a module to be assigned"""
+
+	@property
+	def min_size(self):
+		return max(0, int(ucr.get('umc/module/prefork/min', 1)))
+
+	@property
+	def max_size(self):
+		return max(self.min_size, int(ucr.get('umc/module/prefork/max', 8)))
+
+	@property
+	def window(self):
+		return max(1, int(ucr.get('umc/module/prefork/window', 60)))
+
+	@property
+	def debug_level(self):
+		return int(ucr.get('umc/module/debug/level', 2))
+
+	@property
+	def running(self):
+		return self._shrink.running
+
+	@property
+	def size(self):
+		"""The number of idle processes to keep: the number of claims within the last window"""
+		since = time() - self.window
+		self.claims = [claimed for claimed in self.claims if claimed > since]
+		return min(self.max_size, max(self.min_size, len(self.claims)))
+
+	def __init__(self, command):
+		self.command = command
+		self.idle = []
+		self.claims = []
+		self._filling = None
+		self._shrink = LoopingCall(self.shrink)
+		metrics.gauge('module.prefork.idle', lambda: len(self.idle))
+
+	def start(self):
+		self.fill()
+		self._shrink.start(self.window, now=False)
+
+	def stop(self):
+		if self._shrink.running:
+			self._shrink.stop()
+		if self._filling and self._filling.active():
+			self._filling.cancel()
+		while self.idle:
+			self.release(self.idle.pop())
+
+	def claim(self, socket, module, locale):
+		"""Assigns the module to an idle process. Returns the ModuleProcessProtocol or None if no process is available."""
+		if not self.running:
+			# e.g. the zygote is used instead; the pool must not start processes nobody reaps
+			return
+		self.claims.append(time())
+		self.remove_exited()
+		try:
+			if self.idle:
+				process = self.idle.pop(0)
+				process.assign(dict(socket=socket, module=module, language=locale, debug=self.debug_level))
+				MODULE.info('Assigned module %s to prefork process %d' % (module, process.pid))
+				metrics.counter('module.prefork.hits').increment()
+				return process
+			metrics.counter('module.prefork.misses').increment()
+		finally:
+			self.schedule_fill()
+
+	def schedule_fill(self):
+		if self._filling is None or not self._filling.active():
+			self._filling = reactor.callLater(0, self.fill)
+
+	def fill(self):
+		"""Starts one idle process per reactor iteration until the pool has its desired size"""
+		self.remove_exited()
+		if len(self.idle) >= self.size:
+			return
+		self.idle.append(self.spawn())
+		self.schedule_fill()
+
+	def shrink(self):
+		self.remove_exited()
+		while len(self.idle) > self.size:
+			self.release(self.idle.pop())
+
+	def remove_exited(self):
+		for process in [process for process in self.idle if process.poll() is not None]:
+			MODULE.warn('Prefork process %s exited unexpectedly' % (process.pid,))
+			process.ready.addErrback(lambda failure: None)  # nobody waits for it
+			self.idle.remove(process)
+
+	def spawn(self):
+		args = [self.command, '--prefork', '--ready-fd', str(READY_FD), '-d', str(self.debug_level)]
+		MODULE.info('Starting prefork module process: %s' % (' '.join(args),))
+		return ModuleProcessProtocol.spawn(self.command, args)
+
+	def release(self, process):
+		# the process exits when reading EOF from stdin
+		process.ready.addErrback(lambda failure: None)
+		process.release()
@@ -29,26 +29,69 @@
 # /usr/share/common-licenses/AGPL-3; if not, see
 # <http://www.gnu.org/licenses/>.
 
-import os.path
+import os
+import json
 from os import getpid, kill
 from os.path import join
 from time import time
-from subprocess import Popen
 
 from twisted.web.client import FileBodyProducer
 from twisted.web.client import ProxyAgent
 from twisted.web.http_headers import Headers
 from twisted.internet import reactor
 from twisted.internet.defer import Deferred
+from twisted.internet.protocol import Protocol
 from twisted.internet.endpoints import UNIXClientEndpoint
-from twisted.internet.task import LoopingCall
 
 from univention.umc.util.log import MODULE
 from univention.umc.util.config import ucr
+from univention.umc.util.connection import ModuleConnectionPool
+from univention.umc.util.framing import FramedConnection
+from univention.umc.util.prefork import PreforkPool
+from univention.umc.util.zygote import Zygote
+from univention.umc.util.spawn import ModuleProcessProtocol, READY_FD
 from univention.umc import CouldNotConnect, ModuleProcess, Translation, implements
 
 MODULE_COMMAND = '/usr/sbin/umc-module'
 MODULE_SOCKET_PATH = '/var/run/univention-management-console/'
+ZYGOTE_COMMAND = '/usr/sbin/umc-module-zygote'
+
+prefork_pool = PreforkPool(MODULE_COMMAND)
+zygote = Zygote(ZYGOTE_COMMAND, join(MODULE_SOCKET_PATH, '%u-zygote.socket' % (getpid(),)))
+
+
+class BodyDelivery(Protocol):
+	"""Passes the response body on and reports when it was delivered completely or failed"""
+
+	def __init__(self, protocol, delivered):
+		self.protocol = protocol
+		self.delivered = delivered
+
+	def makeConnection(self, transport):
+		self.protocol.makeConnection(transport)
+
+	def dataReceived(self, data):
+		self.protocol.dataReceived(data)
+
+	def connectionLost(self, reason):
+		try:
+			self.protocol.connectionLost(reason)
+		finally:
+			self.delivered()
+
+
+class ModuleResponse(object):
+	"""A response of a module process whose body delivery is tracked"""
+
+	def __init__(self, response, delivered):
+		self.response = response
+		self.delivered = delivered
+
+	def __getattr__(self, name):
+		return getattr(self.response, name)
+
+	def deliverBody(self, protocol):
+		self.response.deliverBody(BodyDelivery(protocol, self.delivered))
 
 
 class UMCModuleProcess(object):
@@ -58,6 +101,10 @@ class UMCModuleProcess(object):
 	def running(self):
 		return self.process and self.process.poll() is None  # FIXME: not None?
 
+	@property
+	def exited(self):
+		return self.process is not None and self.process.poll() is not None
+
 	@property
 	def pid(self):
 		return self.process and self.process.pid
@@ -66,29 +113,44 @@ class UMCModuleProcess(object):
 	def module_debug_level(self):
 		return int(ucr.get('umc/module/debug/level', 2))
 
+	@property
+	def startup_timeout(self):
+		return int(ucr.get('umc/module/startup/timeout', 10))
+
+	@property
+	def framed(self):
+		return ucr.get('umc/module/transport', 'http') == 'framed'
+
 	@property
 	def module_locale(self):
 		return Translation(self.session).get_language()
 
-	def __init__(self, session, module=None):
+	@property
+	def module_argument(self):
+		# the requested module is loaded first, the other hosted modules on demand
+		return ','.join([self.module] + [module for module in self.hosted if module != self.module])
+
+	def __init__(self, session, module=None, hosted=()):
 		self.session = session
 		self.module = module
+		self.hosted = hosted
 		self.process = None
-		self.socket = None
+		self.socket = self.get_socket_path()
+		self.acls = '%s.acls' % (self.socket,)
+		self.acls_version = None
 		self.proxy = None
+		self.framed_connection = None
+		self.pool = ModuleConnectionPool(reactor)
 		self._connected = None
-		self._connection_attempts = 0
-		self._max_connection_attempts = 200
-		self.session.notifyOnExpire(self.on_session_expired)
+		self.key = None
+		self.credentials = None
+		self.sessions = set()
+		self.pending = 0
+		self.last_request = time()
 
 	def request(self, method, uri, headers=None, body=None):
 		response = Deferred()
 
-		if body:
-			body = FileBodyProducer(body)
-		if headers:
-			headers = Headers(dict(self.__headers(headers)))
-
 		def success(result):
 			if not self.proxy:
 				MODULE.error('Waiting for socket creation timed out... %r' % (result,))
@@ -101,14 +163,51 @@ class UMCModuleProcess(object):
 
 		def request(_):
 			MODULE.info('Passing request %r to module process' % (uri,))
-			return self.proxy.request(method, uri, headers, body)
+			if self.framed_connection is not None:
+				framed = self.framed_connection.request(method, uri, dict((k, v[0]) for k, v in self.__headers(headers or {})), body)
+				framed.addErrback(self._framed_failed, method, uri, headers, body)
+				return framed
+			return self._http_request(method, uri, headers, body)
+
+		self.pending += 1
+		self.last_request = time()
 
 		connection = self.create()
 		connection.addCallback(success)
 		connection.addErrback(failed)
 		response.addCallback(request)
+		response.addCallbacks(self._response_received, self._request_failed)
 		return response
 
+	def _http_request(self, method, uri, headers, body):
+		producer = FileBodyProducer(body) if body else None
+		header = Headers(dict(self.__headers(headers))) if headers else None
+		return self.proxy.request(method, uri, header, producer)
+
+	def _framed_failed(self, failure, method, uri, headers, body):
+		# once the module answered a framed request, failures are not caused by the transport
+		if self.framed_connection is None or self.framed_connection.answered:
+			return failure
+		MODULE.error('Module process %s did not answer over the framed transport; falling back to HTTP: %s' % (self.module, failure.getErrorMessage()))
+		self.framed_connection.close()
+		self.framed_connection = None
+		if body is not None:
+			body.seek(0)
+		return self._http_request(method, uri, headers, body)
+
+	def _response_received(self, response):
+		# the request is pending until the module process has sent the whole body
+		return ModuleResponse(response, self._request_finished)
+
+	def _request_failed(self, failure):
+		self.pool.request_failed(failure)
+		self._request_finished()
+		return failure
+
+	def _request_finished(self):
+		self.pending -= 1
+		self.last_request = time()
+
 	def __headers(self, headers):
 		for k, v in headers.iteritems():
 			if isinstance(v, unicode):
@@ -120,39 +219,71 @@ class UMCModuleProcess(object):
 			return self._connected
 
 		MODULE.info('Starting new module process: %s' % (self.module,))
-		self.socket = self.get_socket_path()
 
+		self.process = zygote.fork(self.socket, self.module_argument, self.module_locale)
+		if self.process is None:
+			self.process = prefork_pool.claim(self.socket, self.module_argument, self.module_locale)
+		if self.process is None:
+			self.process = self.spawn()
+
+		# the module process reports when it accepts connections
+		timeout = reactor.callLater(self.startup_timeout, self._startup_timed_out)
+		self._connected = self.process.ready
+		self._connected.addBoth(self._started, timeout)
+		self._connected.addCallback(self.connect)
+		return self._connected
+
+	def spawn(self):
 		args = [
 			MODULE_COMMAND, '-l', self.module_locale,
-			'-d', str(self.module_debug_level), self.socket, self.module
+			'-d', str(self.module_debug_level),
+			'--ready-fd', str(READY_FD), self.socket, self.module_argument
 		]
 
 		MODULE.info('Module process: %s' % (' '.join(args)))
-		self.process = Popen(args, executable=MODULE_COMMAND, shell=False)  # TODO: stdout, stderr
+		return ModuleProcessProtocol.spawn(MODULE_COMMAND, args)
 
-		connect = LoopingCall(self.connect)
-		connect.a = (connect,)  # twisteds arguments
-		self._connected = connect.start(0.05)
-		return self._connected
+	def _started(self, result, timeout):
+		if timeout.active():
+			timeout.cancel()
+		return result
+
+	def _startup_timed_out(self):
+		self.process.set_failed('The module process did not start within %d seconds' % (self.startup_timeout,))
+		if self.running:
+			self.kill()
+
+	def connect(self, process):
+		endpoint = UNIXClientEndpoint(reactor, self.socket)
+		if self.framed:
+			self.framed_connection = FramedConnection(endpoint)
+		self.proxy = ProxyAgent(endpoint, reactor, pool=self.pool)
 
-	def connect(self, loop):
-		if self.socket_exists():
-			self.proxy = ProxyAgent(UNIXClientEndpoint(reactor, self.socket))
-			loop.stop()
-		else:
-			self._connection_attempts += 1
-			if not self.running or self._connection_attempts > self._max_connection_attempts:
-				raise CouldNotConnect('Socket %s does not exists' % (self.socket,))
+	def set_acls(self, acls):
+		"""Writes the ACLs for the module process unless it already has this version"""
+		if acls.version == self.acls_version:
+			return
+		MODULE.info('Passing ACLs %s to module process %s' % (acls.version, self.module))
+		filename = '%s.tmp' % (self.acls,)
+		fd = os.open(filename, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0600)
+		with os.fdopen(fd, 'wb') as fd:
+			fd.write('{"version": %s, "acls": %s}' % (json.dumps(acls.version), acls.json()))
+		os.rename(filename, self.acls)
+		self.acls_version = acls.version
 
 	def get_socket_path(self):
 		return join(MODULE_SOCKET_PATH, '%u-%lu.socket' % (getpid(), long(time() * 1000)))
 
-	def socket_exists(self):
-		return os.path.exists(self.socket)
+	def cleanup(self):
+		self.pool.closeCachedConnections()
+		if self.framed_connection is not None:
+			self.framed_connection.close()
+		try:
+			os.unlink(self.acls)
+		except OSError:
+			pass
 
 	def kill(self, signal=15):
-		kill(self.pid, signal)
-
-	def on_session_expired(self):
-		if self.running:
-			self.kill()
+		self.cleanup()
+		if self.pid:
+			kill(self.pid, signal)
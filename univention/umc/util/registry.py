@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+#
+# Univention Management Console
+#
+# Copyright 2014 Univention GmbH
+#
+# http://www.univention.de/
+#
+# All rights reserved.
+#
+# The source code of this program is made available
+# under the terms of the GNU Affero General Public License version 3
+# (GNU AGPL V3) as published by the Free Software Foundation.
+#
+# Binary versions of this program provided by Univention to you as
+# well as other copyrighted, protected or trademarked materials like
+# Logos, graphics, fonts, specific documentations and configurations,
+# cryptographic keys etc. are subject to a license agreement between
+# you and Univention and not subject to the GNU AGPL V3.
+#
+# In the case you use this program under the terms of the GNU AGPL V3,
+# the program is provided in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public
+# License with the Debian GNU/Linux or Univention distribution in file
+# /usr/share/common-licenses/AGPL-3; if not, see
+# <http://www.gnu.org/licenses/>.
+
+from time import time
+from hashlib import sha256
+
+from twisted.internet.task import LoopingCall
+
+from univention.umc.util.log import MODULE
+from univention.umc.util.config import ucr
+from univention.umc.util.metrics import metrics
+from univention.umc.util.process import UMCModuleProcess
+from univention.umc import TooManyProcesses, User, Translation
+
+__all__ = ['ModuleProcessRegistry', 'module_processes']
+
+REAP_INTERVAL = 30
+HOST_MODULE = '__host__'
+
+
+def get_available_memory():
+	"""Returns the available memory in kilobyte or None if unknown"""
+	try:
+		with open('/proc/meminfo') as fd:
+			meminfo = dict((line.split(':')[0], int(line.split()[1])) for line in fd if line.split()[1:])
+	except (IOError, ValueError, IndexError):
+		return
+	if 'MemAvailable' in meminfo:
+		return meminfo['MemAvailable']
+	return sum(meminfo.get(key, 0) for key in ('MemFree', 'Buffers', 'Cached'))
+
+
+class ModuleProcessRegistry(object):
+	"""Knows all module processes; limits their number and stops idle ones"""
+
+	@property
+	def max_processes(self):
+		return int(ucr.get('umc/module/processes/max', 256))
+
+	@property
+	def max_processes_per_session(self):
+		return int(ucr.get('umc/module/processes/session/max', 32))
+
+	@property
+	def idle_timeout(self):
+		# module processes keep state of their session, so they are not stopped unless configured
+		return int(ucr.get('umc/module/idle_timeout', 0) or 0)
+
+	@property
+	def min_free_memory(self):
+		return int(ucr.get('umc/module/memory/min_free', 131072))  # kilobyte
+
+	@property
+	def shared(self):
+		return ucr.is_true('umc/module/processes/shared', False)
+
+	@property
+	def host_modules(self):
+		"""The lightweight modules which are trusted to share one module process"""
+		return tuple(ucr.get('umc/module/host/modules', '').split())
+
+	def __init__(self):
+		self.processes = {}
+		self.sessions = set()
+		self._reaper = LoopingCall(self.reap)
+		metrics.gauge('module.processes', lambda: len(self.processes))
+
+	def start(self):
+		self._reaper.start(REAP_INTERVAL, now=False)
+
+	def stop(self):
+		if self._reaper.running:
+			self._reaper.stop()
+		for process in self.processes.values():
+			self.remove(process)
+
+	def get(self, session, module):
+		key = self.get_key(session, module)
+		process = self.processes.get(key)
+		if process is not None and process.exited:
+			MODULE.warn('Module process of %s has exited; starting a new one' % (module,))
+			self.remove(process)
+			process = None
+		if process is not None and process.credentials != self.get_credentials(session):
+			# e.g. the password was changed: the module process would still use the old one
+			MODULE.process('Credentials of %s changed; restarting module process %s' % (User(session).username, module))
+			self.remove(process)
+			process = None
+		if process is None:
+			process = self.add(key, session, module)
+		self.attach(process, session)
+		process.last_request = time()
+		return process
+
+	def get_key(self, session, module):
+		"""Module processes are either bound to a session or shared by all sessions of a user with the same locale"""
+		if module in self.host_modules:
+			module = HOST_MODULE
+		if self.shared:
+			return (User(session).username, module, Translation(session).get_language())
+		return (session.uid, module)
+
+	def get_credentials(self, session):
+		user = User(session)
+		return sha256('%s:%s' % (user.username, user.password)).hexdigest()
+
+	def add(self, key, session, module):
+		session_processes = [process for process in self.processes.itervalues() if session.uid in process.sessions]
+		if self.max_processes_per_session and len(session_processes) >= self.max_processes_per_session:
+			self.evict(session_processes, 'the session reached its maximum of %d module processes' % (self.max_processes_per_session,))
+		if self.max_processes and len(self.processes) >= self.max_processes:
+			self.evict(self.processes.values(), 'the maximum of %d module processes is reached' % (self.max_processes,))
+
+		hosted = self.host_modules if module in self.host_modules else ()
+		process = UMCModuleProcess(session, module, hosted)
+		process.key = key
+		process.credentials = self.get_credentials(session)
+		self.processes[key] = process
+		return process
+
+	def attach(self, process, session):
+		"""References the process by the session; it lives until the last of its sessions expires"""
+		process.sessions.add(session.uid)
+		if session.uid not in self.sessions:
+			self.sessions.add(session.uid)
+			session.notifyOnExpire(lambda: self.on_session_expired(session))
+
+	def remove(self, process):
+		if self.processes.get(process.key) is process:
+			del self.processes[process.key]
+		if process.running:
+			process.kill()
+		else:
+			process.cleanup()
+
+	def evict(self, processes, reason):
+		"""Stops the least recently used module process which has no pending requests"""
+		idle = [process for process in processes if not process.pending]
+		if not idle:
+			MODULE.warn('Cannot start module process: %s' % (reason,))
+			raise TooManyProcesses(reason)
+		process = min(idle, key=lambda process: process.last_request)
+		MODULE.process('Stopping least recently used module process %s (%s): %s' % (process.module, process.pid, reason))
+		metrics.counter('module.processes.evicted').increment()
+		self.remove(process)
+
+	def on_session_expired(self, session):
+		self.sessions.discard(session.uid)
+		for process in self.processes.values():
+			process.sessions.discard(session.uid)
+			if not process.sessions:
+				self.remove(process)
+
+	def reap(self):
+		now = time()
+		for process in self.processes.values():
+			if process.exited:
+				self.remove(process)
+			elif self.idle_timeout and not process.pending and now - process.last_request > self.idle_timeout:
+				MODULE.process('Stopping idle module process %s (%s)' % (process.module, process.pid))
+				metrics.counter('module.processes.reaped').increment()
+				self.remove(process)
+
+		# one process per run: the memory is freed only after the process has exited
+		available = get_available_memory()
+		if available is not None and available < self.min_free_memory and self.processes:
+			try:
+				self.evict(self.processes.values(), 'only %d KiB memory available' % (available,))
+			except TooManyProcesses:
+				pass
+
+module_processes = ModuleProcessRegistry()
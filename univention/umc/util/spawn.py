@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+#
+# Univention Management Console
+#
+# Copyright 2014 Univention GmbH
+#
+# http://www.univention.de/
+#
+# All rights reserved.
+#
+# The source code of this program is made available
+# under the terms of the GNU Affero General Public License version 3
+# (GNU AGPL V3) as published by the Free Software Foundation.
+#
+# Binary versions of this program provided by Univention to you as
+# well as other copyrighted, protected or trademarked materials like
+# Logos, graphics, fonts, specific documentations and configurations,
+# cryptographic keys etc. are subject to a license agreement between
+# you and Univention and not subject to the GNU AGPL V3.
+#
+# In the case you use this program under the terms of the GNU AGPL V3,
+# the program is provided in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public
+# License with the Debian GNU/Linux or Univention distribution in file
+# /usr/share/common-licenses/AGPL-3; if not, see
+# <http://www.gnu.org/licenses/>.
+
+import os
+import json
+from time import time
+
+from twisted.internet import reactor
+from twisted.internet.defer import Deferred
+from twisted.internet.protocol import ProcessProtocol
+
+from univention.umc.util.log import MODULE
+from univention.umc.util.metrics import metrics
+from univention.umc import CouldNotConnect
+
+__all__ = ['ModuleStartup', 'ModuleProcessProtocol', 'READY_FD']
+
+# the module process writes a line to this file descriptor as soon as it listens on its socket
+READY_FD = 3
+
+
+class ModuleStartup(object):
+	"""Tracks the startup of a module process. ready fires when the module accepts connections."""
+
+	def __init__(self):
+		self.ready = Deferred()
+		self.started = time()
+		self.pid = None
+		self.returncode = None
+
+	def poll(self):
+		return self.returncode
+
+	def set_ready(self):
+		if self.ready.called:
+			return
+		latency = time() - self.started
+		MODULE.info('Module process %s is ready after %.3f seconds' % (self.pid, latency))
+		metrics.histogram('module.spawn.latency').observe(latency)
+		self.ready.callback(self)
+
+	def set_failed(self, message):
+		if self.ready.called:
+			return
+		metrics.counter('module.spawn.failures').increment()
+		self.ready.errback(CouldNotConnect(message))
+
+
+class ModuleProcessProtocol(ModuleStartup, ProcessProtocol):
+	"""A module process spawned by umc-server"""
+
+	def __init__(self):
+		ModuleStartup.__init__(self)
+
+	@classmethod
+	def spawn(cls, command, args):
+		process = cls()
+		reactor.spawnProcess(
+			process, command, args, env=os.environ,
+			childFDs={0: 'w', 1: 1, 2: 2, READY_FD: 'r'}
+		)
+		return process
+
+	def assign(self, assignment):
+		"""Assigns a module to a prefork process"""
+		self.started = time()
+		self.transport.writeToChild(0, '%s\n' % (json.dumps(assignment),))
+		self.transport.closeStdin()
+
+	def release(self):
+		"""Lets an unassigned prefork process exit"""
+		self.transport.closeStdin()
+
+	def connectionMade(self):
+		self.pid = self.transport.pid
+
+	def childDataReceived(self, childFD, data):
+		if childFD == READY_FD:
+			self.transport.closeChildFD(READY_FD)
+			self.set_ready()
+
+	def processEnded(self, reason):
+		self.returncode = getattr(reason.value, 'exitCode', None)
+		if self.returncode is None:
+			self.returncode = -(getattr(reason.value, 'signal', None) or 1)
+		self.set_failed('The module process exited before it was ready')
@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+#
+# Univention Management Console
+#
+# Copyright 2014 Univention GmbH
+#
+# http://www.univention.de/
+#
+# All rights reserved.
+#
+# The source code of this program is made available
+# under the terms of the GNU Affero General Public License version 3
+# (GNU AGPL V3) as published by the Free Software Foundation.
+#
+# Binary versions of this program provided by Univention to you as
+# well as other copyrighted, protected or trademarked materials like
+# Logos, graphics, fonts, specific documentations and configurations,
+# cryptographic keys etc. are subject to a license agreement between
+# you and Univention and not subject to the GNU AGPL V3.
+#
+# In the case you use this program under the terms of the GNU AGPL V3,
+# the program is provided in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public
+# License with the Debian GNU/Linux or Univention distribution in file
+# /usr/share/common-licenses/AGPL-3; if not, see
+# <http://www.gnu.org/licenses/>.
+
+import json
+from os import kill, unlink
+from os.path import exists
+from subprocess import Popen, PIPE
+
+from twisted.internet import reactor
+from twisted.internet.protocol import ClientFactory
+from twisted.internet.endpoints import UNIXClientEndpoint
+from twisted.protocols.basic import LineOnlyReceiver
+
+from univention.umc.util.log import MODULE
+from univention.umc.util.config import ucr
+from univention.umc.util.metrics import metrics
+from univention.umc.util.spawn import ModuleStartup
+
+__all__ = ['Zygote', 'ForkedProcess']
+
+
+class ForkedProcess(ModuleStartup):
+	"""A module process forked by the zygote"""
+
+	def poll(self):
+		# the process is no child of ours: the zygote reaps it
+		if self.returncode is None and self.pid is not None:
+			try:
+				kill(self.pid, 0)
+			except OSError:
+				self.returncode = -1
+		return self.returncode
+
+
+class _ForkRequest(LineOnlyReceiver):
+
+	delimiter = b'\n'
+
+	def connectionMade(self):
+		self.sendLine(json.dumps(self.factory.assignment))
+
+	def lineReceived(self, line):
+		# the zygote answers with the PID, the forked module process reports its readiness
+		# on the same connection; both close it afterwards
+		message = json.loads(line)
+		self.factory.process.pid = int(message['pid'])
+		if message.get('ready'):
+			self.factory.process.set_ready()
+
+	def connectionLost(self, reason):
+		process = self.factory.process
+		if process.pid is None:
+			MODULE.error('The zygote did not fork a module process: %s' % (reason.getErrorMessage(),))
+			process.returncode = -1
+		process.set_failed('The forked module process exited before it was ready')
+
+
+class _ForkRequestFactory(ClientFactory):
+
+	protocol = _ForkRequest
+
+	def __init__(self, assignment, process):
+		self.assignment = assignment
+		self.process = process
+
+
+class Zygote(object):
+	"""Starts the module zygote and lets it fork new module processes"""
+
+	@property
+	def enabled(self):
+		return ucr.is_true('umc/module/zygote', False)
+
+	@property
+	def running(self):
+		return self.process is not None and self.process.poll() is None
+
+	@property
+	def ready(self):
+		# the zygote creates its control socket after preloading the dependencies
+		return self.running and exists(self.socket)
+
+	@property
+	def debug_level(self):
+		return int(ucr.get('umc/module/debug/level', 2))
+
+	def __init__(self, command, socket):
+		self.command = command
+		self.socket = socket
+		self.process = None
+
+	def start(self):
+		if not self.enabled or self.running:
+			return
+		if exists(self.socket):
+			unlink(self.socket)
+
+		args = [self.command, '-d', str(self.debug_level), self.socket]
+		MODULE.info('Starting module zygote: %s' % (' '.join(args),))
+		# the zygote exits when its stdin is closed
+		self.process = Popen(args, executable=self.command, shell=False, stdin=PIPE)
+
+	def stop(self):
+		if self.running:
+			self.process.stdin.close()
+
+	def fork(self, socket, module, locale):
+		"""Requests a new module process. Returns a ForkedProcess or None if the zygote is not ready."""
+		if not self.ready:
+			if self.enabled and not self.running:
+				self.start()
+			return
+
+		process = ForkedProcess()
+		assignment = dict(socket=socket, module=module, language=locale, debug=self.debug_level)
+		connection = UNIXClientEndpoint(reactor, self.socket).connect(_ForkRequestFactory(assignment, process))
+		connection.addErrback(self._fork_failed, process)
+		metrics.counter('module.zygote.forks').increment()
+		return process
+
+	def _fork_failed(self, failure, process):
+		MODULE.error('Could not connect to the module zygote: %s' % (failure.getErrorMessage(),))
+		process.returncode = -1
+		process.set_failed('Could not connect to the module zygote')
@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+#
+# Univention Management Console
+#
+# Copyright 2014 Univention GmbH
+#
+# http://www.univention.de/
+#
+# All rights reserved.
+#
+# The source code of this program is made available
+# under the terms of the GNU Affero General Public License version 3
+# (GNU AGPL V3) as published by the Free Software Foundation.
+#
+# Binary versions of this program provided by Univention to you as
+# well as other copyrighted, protected or trademarked materials like
+# Logos, graphics, fonts, specific documentations and configurations,
+# cryptographic keys etc. are subject to a license agreement between
+# you and Univention and not subject to the GNU AGPL V3.
+#
+# In the case you use this program under the terms of the GNU AGPL V3,
+# the program is provided in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public
+# License with the Debian GNU/Linux or Univention distribution in file
+# /usr/share/common-licenses/AGPL-3; if not, see
+# <http://www.gnu.org/licenses/>.
+
+# This module must not import twisted.internet.reactor (directly or via
+# univention.umc.util): the reactor would be shared by all forked module processes.
+
+import os
+import sys
+import json
+import socket
+import gettext
+from glob import glob
+from select import select
+from signal import signal, SIGCHLD, SIG_IGN, SIG_DFL
+from argparse import ArgumentParser
+from traceback import format_exc
+
+from univention.management.console.log import MODULE, log_init
+from univention.management.console.config import ucr
+
+__all__ = ['ModuleZygote', 'PRELOAD_MODULES', 'preload']
+
+MODULE_COMMAND = '/usr/sbin/umc-module'
+LOCALE_DIR = '/usr/share/locale'
+PRELOAD_MODULES = (
+	'univention.management.console.modules',
+	'univention.management.console.protocol.definitions',
+	'univention.admin.handlers',
+	'univention.admin.syntax',
+	'univention.admin.objects',
+	'univention.lib.i18n',
+)
+
+
+def preload(modules):
+	"""Imports the given modules, ignoring those which are not installed"""
+	for name in modules:
+		try:
+			__import__(name)
+		except ImportError as exc:
+			MODULE.warn('Could not preload %s: %s' % (name, exc))
+
+
+class ModuleZygote(object):
+	"""Preloads the module dependencies once and forks a module process for each request of umc-server"""
+
+	@property
+	def preload_modules(self):
+		return ucr.get('umc/module/zygote/preload', ' '.join(PRELOAD_MODULES)).split()
+
+	@property
+	def translation_domains(self):
+		return ucr.get('umc/module/zygote/translations', 'univention-management-console* univention-admin*').split()
+
+	def __init__(self):
+		self.options = None
+		self.listener = None
+		self.main()
+		self.listen()
+
+	def parse_arguments(self):
+		parser = ArgumentParser()
+		add = parser.add_argument
+		add(
+			'socket', type=str, action='store',
+			help='defines the control socket on which umc-server requests new module processes'
+		)
+		add(
+			'-d', '--debug', default=int(ucr.get('umc/module/debug/level', 2)),
+			action='store', type=int, dest='debug',
+			help='if given than debugging is activated and set to the specified level [default: %(default)s]'
+		)
+		add(
+			'-L', '--log-file', default='management-console-module-zygote',
+			action='store', dest='logfile',
+			help='specifies an alternative log file [default: %(default)s]'
+		)
+		self.options = parser.parse_args()
+
+		if os.getuid() != 0:
+			parser.error('%s must be started as root' % os.path.basename(sys.argv[0]))
+
+	def main(self):
+		self.parse_arguments()
+		os.environ.clear()
+		os.environ['PATH'] = '/bin:/sbin:/usr/bin:/usr/sbin'
+		log_init(self.options.logfile, self.options.debug)
+		# forked module processes are reaped automatically
+		signal(SIGCHLD, SIG_IGN)
+		self.preload()
+
+	def preload(self):
+		MODULE.process('Preloading module dependencies')
+		preload(self.preload_modules)
+
+		import univention.admin.modules as udm_modules
+		udm_modules.update()
+
+		self.preload_translations()
+		MODULE.process('Preloading finished')
+
+	def preload_translations(self):
+		# gettext caches parsed catalogs, the forked processes share them copy-on-write
+		for domain in self.translation_domains:
+			for mofile in glob(os.path.join(LOCALE_DIR, '*', 'LC_MESSAGES', '%s.mo' % (domain,))):
+				language = mofile[len(LOCALE_DIR):].split(os.sep)[1]
+				gettext.translation(os.path.basename(mofile)[:-3], LOCALE_DIR, [language], fallback=True)
+
+	def listen(self):
+		if os.path.exists(self.options.socket):
+			os.unlink(self.options.socket)
+
+		# the control socket is only accessable by root; it exists as soon as the preloading is done
+		old_umask = os.umask(0077)
+		try:
+			self.listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+			self.listener.bind(self.options.socket)
+			self.listener.listen(128)
+		finally:
+			os.umask(old_umask)
+
+		try:
+			self.serve()
+		finally:
+			self.listener.close()
+			os.unlink(self.options.socket)
+
+	def serve(self):
+		while True:
+			readable = select([self.listener, sys.stdin], [], [])[0]
+			if sys.stdin in readable and not os.read(sys.stdin.fileno(), 1024):
+				# umc-server closed the pipe
+				MODULE.process('umc-server has gone; exiting')
+				return
+			if self.listener in readable:
+				connection = self.listener.accept()[0]
+				try:
+					self.handle(connection)
+				except (IOError, socket.error, ValueError, KeyError) as exc:
+					MODULE.error('Could not fork module process: %s' % (exc,))
+				finally:
+					connection.close()
+
+	def handle(self, connection):
+		assignment = json.loads(connection.makefile().readline())
+		pid = self.fork(connection, assignment)
+		MODULE.info('Forked module process %d for module %s' % (pid, assignment['module']))
+		connection.sendall('%s\n' % (json.dumps(dict(pid=pid)),))
+
+	def fork(self, connection, assignment):
+		pid = os.fork()
+		if pid:
+			return pid
+
+		status = 1
+		try:
+			# the connection stays open: the module process reports its readiness on it
+			self.listener.close()
+			devnull = os.open(os.devnull, os.O_RDONLY)
+			os.dup2(devnull, sys.stdin.fileno())
+			os.close(devnull)
+			signal(SIGCHLD, SIG_DFL)
+			self.run_module(assignment, connection.fileno())
+			status = 0
+		except SystemExit as exc:
+			status = exc.code if isinstance(exc.code, int) else int(exc.code is not None)
+		except:
+			MODULE.error(format_exc())
+		finally:
+			os._exit(status)
+
+	def run_module(self, assignment, ready_fd):
+		sys.argv = [
+			MODULE_COMMAND, '-l', assignment['language'].encode('UTF-8'),
+			'-d', str(assignment['debug']), '--ready-fd', str(ready_fd),
+			assignment['socket'].encode('UTF-8'), assignment['module'].encode('UTF-8')
+		]
+		from univention.umc.module import ModuleDaemon
+		ModuleDaemon()